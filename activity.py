@@ -0,0 +1,96 @@
+import argparse
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import app, db
+from models import DailyActivity, VocabularyReview, ChatSession
+
+HEATMAP_DAYS = 365
+
+
+def record_activity(user_id, reviews=0, conversations=0, day=None):
+    # A single INSERT ... ON CONFLICT keeps concurrent increments for the same
+    # user and day from losing updates; it joins the caller's transaction.
+    day = day or date.today()
+    statement = _insert().values(user_id=user_id, day=day, reviews=reviews, conversations=conversations)
+    statement = statement.on_conflict_do_update(
+        index_elements=[DailyActivity.user_id, DailyActivity.day],
+        set_={
+            'reviews': DailyActivity.reviews + statement.excluded.reviews,
+            'conversations': DailyActivity.conversations + statement.excluded.conversations,
+        }
+    )
+    db.session.execute(statement)
+
+
+def _insert():
+    insert = postgresql.insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    return insert(DailyActivity)
+
+
+def activity_by_day(user_id, days=HEATMAP_DAYS, today=None):
+    today = today or date.today()
+    rows = db.session.query(DailyActivity.day, DailyActivity.reviews, DailyActivity.conversations).filter(
+        DailyActivity.user_id == user_id,
+        DailyActivity.day > today - timedelta(days=days),
+        DailyActivity.day <= today
+    )
+    return {day: (reviews, conversations) for day, reviews, conversations in rows}
+
+
+def backfill():
+    # Reviews only remember their latest rating, so history before the rollup
+    # existed is approximated by one review per card on its last_reviewed day.
+    # That estimate is only written for user-days the rollup has no row for;
+    # rows recorded by record_activity are exact and are never replaced.
+    review_days = db.session.query(
+        VocabularyReview.user_id, func.date(VocabularyReview.last_reviewed), func.count(VocabularyReview.id)
+    ).filter(VocabularyReview.last_reviewed != None).group_by(
+        VocabularyReview.user_id, func.date(VocabularyReview.last_reviewed)
+    )
+    session_days = db.session.query(
+        ChatSession.user_id, func.date(ChatSession.ended_at), func.count(ChatSession.id)
+    ).filter(ChatSession.ended_at != None).group_by(
+        ChatSession.user_id, func.date(ChatSession.ended_at)
+    )
+
+    totals = {}
+    for user_id, day, count in review_days:
+        totals.setdefault((user_id, _as_date(day)), [0, 0])[0] += count
+    for user_id, day, count in session_days:
+        totals.setdefault((user_id, _as_date(day)), [0, 0])[1] += count
+
+    existing = set(db.session.query(DailyActivity.user_id, DailyActivity.day))
+    missing = [
+        {'user_id': user_id, 'day': day, 'reviews': reviews, 'conversations': conversations}
+        for (user_id, day), (reviews, conversations) in totals.items()
+        if (user_id, day) not in existing
+    ]
+    if missing:
+        statement = _insert().on_conflict_do_nothing(index_elements=[DailyActivity.user_id, DailyActivity.day])
+        db.session.execute(statement, missing)
+    db.session.commit()
+    return len(missing)
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the daily activity rollup")
+    parser.add_argument('--backfill', action='store_true',
+                        help="fill in user-days missing from the rollup from existing reviews and chat sessions")
+    args = parser.parse_args()
+
+    if args.backfill:
+        with app.app_context():
+            print(f"Backfilled {backfill()} user-days")
+    else:
+        parser.print_help()
@@ -6,29 +6,54 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-logging.basicConfig(level=logging.DEBUG)
+import assets
+import compression
+import db_pool
+import log_setup
+import metrics
+import profiler
+import template_cache
+from replica import RoutingSession
+
+log_setup.configure()
 
 
 class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 
-app = Flask(__name__)
+# Page templates live next to the modules rather than in a templates/ folder.
+app = Flask(__name__, template_folder='.')
 app.secret_key = os.environ.get("SESSION_SECRET")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+log_setup.init_app(app)
+assets.init_app(app)
+metrics.init_app(app)
+profiler.init_app(app)
+compression.init_app(app)
+template_cache.init_app(app)
 
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = db_pool.engine_options()
+if os.environ.get("READ_REPLICA_URL"):
+    app.config["SQLALCHEMY_BINDS"] = {"replica": os.environ["READ_REPLICA_URL"]}
 
 db.init_app(app)
+db_pool.init_app(app, db)
 
 with app.app_context():
     import models
+    import schema
     db.create_all()
+    schema.upgrade(db.engine)
     logging.info("Database tables created")
+
+if os.environ.get("SESSION_STORE") == "database":
+    from session_store import DatabaseSessionInterface
+    app.session_interface = DatabaseSessionInterface()
+else:
+    from session_store import CookieSessionInterface
+    app.session_interface = CookieSessionInterface()
@@ -0,0 +1,161 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import request, send_from_directory
+
+import compression
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Logical name (what templates pass to url_for('static', ...)) -> source file.
+ASSETS = {
+    'css/style.css': os.path.join(STATIC_DIR, 'css', 'style.css'),
+    'vendor/chart.umd.js': os.path.join(STATIC_DIR, 'vendor', 'chart.umd.js'),
+}
+PREMINIFIED_DIRS = ('vendor/',)
+
+HASH_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+manifest = {}
+
+
+def minify_css(source):
+    if rcssmin is not None:
+        return rcssmin.cssmin(source)
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    source = re.sub(r':\s+', ':', source)
+    return source.replace(';}', '}').strip()
+
+
+def minify_js(source):
+    if rjsmin is not None:
+        return rjsmin.jsmin(source)
+    return source
+
+
+def minify(logical_name, source):
+    if logical_name.startswith(PREMINIFIED_DIRS):
+        return source
+    if logical_name.endswith('.css'):
+        return minify_css(source)
+    if logical_name.endswith('.js'):
+        return minify_js(source)
+    return source
+
+
+def write_compressed(path, data):
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build(static_dir=STATIC_DIR):
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+
+    built = {}
+    for logical_name, source_path in ASSETS.items():
+        if not os.path.exists(source_path):
+            raise SystemExit(f"Missing asset source {source_path}")
+
+        with open(source_path, encoding='utf-8') as f:
+            data = minify(logical_name, f.read()).encode('utf-8')
+
+        stem, ext = os.path.splitext(logical_name)
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        hashed_name = f"{DIST_DIR}/{stem}.{digest}{ext}"
+        output_path = os.path.join(static_dir, hashed_name)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        write_compressed(output_path, data)
+
+        built[logical_name] = hashed_name
+        print(f"{logical_name} -> {hashed_name} ({os.path.getsize(source_path)} -> {len(data)} bytes)")
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(built, f, indent=2, sort_keys=True)
+    if brotli is None:
+        print("brotli is not installed; only gzip variants were written")
+    return built
+
+
+def load_manifest(static_dir):
+    path = os.path.join(static_dir, DIST_DIR, MANIFEST_NAME)
+    if not os.path.exists(path):
+        logging.warning(f"No asset manifest at {path}; serving unhashed static files (run `python assets.py`)")
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def init_app(app):
+    manifest.update(load_manifest(app.static_folder))
+    serve_unhashed = app.view_functions['static']
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def serve_static(filename):
+        if not filename.startswith(DIST_DIR + '/'):
+            return serve_unhashed(filename=filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        accepted = compression.accepted_encodings(request.headers.get('Accept-Encoding'))
+        for encoding, suffix in ENCODINGS:
+            if encoding in accepted and os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+                response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype,
+                                               max_age=IMMUTABLE_MAX_AGE)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(app.static_folder, filename, max_age=IMMUTABLE_MAX_AGE)
+
+        # Hashed names change whenever the content does, so browsers may keep
+        # these forever without revalidating.
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = serve_static
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Minify, fingerprint and precompress static assets")
+    parser.add_argument('--static-dir', default=STATIC_DIR)
+    args = parser.parse_args()
+    build(args.static_dir)
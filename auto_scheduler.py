@@ -0,0 +1,132 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app import app, db
+from models import User, LessonCategory, UserProgress, ScheduledLesson
+import availability_service
+import calendar_outbox
+import calendar_service
+
+CHUNK_SIZE = int(os.environ.get('AUTO_SCHEDULER_CHUNK_SIZE', 200))
+MAX_WORKERS = int(os.environ.get('AUTO_SCHEDULER_WORKERS', 8))
+
+
+def next_category(user_id, categories):
+    has_upcoming = db.session.query(ScheduledLesson.id).filter(
+        ScheduledLesson.user_id == user_id,
+        ScheduledLesson.completed == False,
+        ScheduledLesson.scheduled_time >= datetime.utcnow()
+    ).first()
+    if has_upcoming:
+        return None
+
+    completed_ids = {row.category_id for row in db.session.query(UserProgress.category_id).filter_by(
+        user_id=user_id,
+        conversation_completed=True
+    )}
+    for category_id, category_name in categories:
+        if category_id not in completed_ids:
+            return category_id, category_name
+    return None
+
+
+def schedule_next_lesson(user_id, categories):
+    with app.app_context():
+        try:
+            user = db.session.get(User, user_id)
+            if user is None or not user.calendar_connected:
+                return 'skipped'
+
+            category = next_category(user_id, categories)
+            if category is None:
+                return 'skipped'
+            category_id, category_name = category
+
+            calendar_service.rate_limiter.acquire()
+            slot = availability_service.find_user_slot(user)
+            if not slot:
+                return 'no_slot'
+
+            lesson = ScheduledLesson(
+                user_id=user_id,
+                category_id=category_id,
+                scheduled_time=slot,
+                duration_minutes=user.lesson_duration
+            )
+            db.session.add(lesson)
+            calendar_outbox.enqueue_create(
+                lesson,
+                f"Lango Spanish Lesson: {category_name}",
+                f"Time to learn Spanish! Category: {category_name}"
+            )
+            db.session.commit()
+            return 'scheduled'
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Auto-scheduling failed for user {user_id}: {e}")
+            return 'failed'
+
+
+def iter_user_chunks(chunk_size=CHUNK_SIZE):
+    last_id = None
+    while True:
+        with app.app_context():
+            query = db.session.query(User.id).filter(User.calendar_connected == True)
+            if last_id is not None:
+                query = query.filter(User.id > last_id)
+            user_ids = [row.id for row in query.order_by(User.id).limit(chunk_size)]
+        if not user_ids:
+            return
+        yield user_ids
+        last_id = user_ids[-1]
+
+
+def drain_outbox():
+    # Every Calendar request the outbox makes waits on the shared limiter.
+    with app.app_context():
+        while calendar_outbox.dispatch_pending() == calendar_outbox.BATCH_SIZE:
+            pass
+
+
+def run(chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS, rate_limit=calendar_service.CALENDAR_RATE_LIMIT):
+    with app.app_context():
+        categories = [(c.id, c.name) for c in LessonCategory.query.order_by(LessonCategory.order).all()]
+
+    calendar_service.rate_limiter.set_rate(rate_limit)
+    report = {'processed': 0, 'scheduled': 0, 'skipped': 0, 'no_slot': 0, 'failed': 0}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for user_ids in iter_user_chunks(chunk_size):
+            for outcome in executor.map(lambda user_id: schedule_next_lesson(user_id, categories), user_ids):
+                report[outcome] += 1
+            report['processed'] += len(user_ids)
+
+            elapsed = time.monotonic() - started
+            logging.info(
+                f"Auto-scheduler progress: {report['processed']} users, "
+                f"{report['scheduled']} scheduled, {report['failed']} failed, "
+                f"{report['processed'] / elapsed if elapsed else 0:.1f} users/s"
+            )
+
+    drain_outbox()
+
+    report['elapsed_seconds'] = round(time.monotonic() - started, 2)
+    report['users_per_second'] = round(report['processed'] / report['elapsed_seconds'], 2) if report['elapsed_seconds'] else 0
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Schedule the next lesson for every calendar-connected user")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    parser.add_argument('--rate-limit', type=float, default=calendar_service.CALENDAR_RATE_LIMIT,
+                        help="maximum Calendar API calls per second")
+    args = parser.parse_args()
+
+    report = run(args.chunk_size, args.workers, args.rate_limit)
+    print(report)
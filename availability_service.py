@@ -0,0 +1,95 @@
+import os
+from datetime import datetime, timedelta
+
+from app import db
+from models import ScheduledLesson
+import calendar_service
+
+QUIET_HOURS_START = int(os.environ.get('QUIET_HOURS_START', 23))
+QUIET_HOURS_END = int(os.environ.get('QUIET_HOURS_END', 6))
+MAX_LESSON_MINUTES = 120
+
+
+def parse_preferred_hour(preferred_time):
+    if not preferred_time:
+        return None
+    try:
+        return int(preferred_time.split(':')[0])
+    except ValueError:
+        return None
+
+
+def lesson_busy_times(user_id, time_min, time_max, exclude_lesson_id=None):
+    # Lessons are short, so anything overlapping the window starts no earlier
+    # than MAX_LESSON_MINUTES before it; that keeps this a range scan on
+    # (user_id, scheduled_time).
+    query = db.session.query(
+        ScheduledLesson.scheduled_time,
+        ScheduledLesson.duration_minutes
+    ).filter(
+        ScheduledLesson.user_id == user_id,
+        ScheduledLesson.completed == False,
+        ScheduledLesson.scheduled_time >= time_min - timedelta(minutes=MAX_LESSON_MINUTES),
+        ScheduledLesson.scheduled_time < time_max
+    )
+    if exclude_lesson_id is not None:
+        query = query.filter(ScheduledLesson.id != exclude_lesson_id)
+
+    busy_times = []
+    for scheduled_time, duration_minutes in query:
+        end_time = scheduled_time + timedelta(minutes=duration_minutes or 30)
+        if end_time > time_min:
+            busy_times.append((scheduled_time, end_time))
+    return busy_times
+
+
+def quiet_busy_times(time_min, time_max, start_hour=QUIET_HOURS_START, end_hour=QUIET_HOURS_END):
+    busy_times = []
+    day = datetime.combine(time_min.date() - timedelta(days=1), datetime.min.time())
+
+    while day < time_max:
+        quiet_start = day + timedelta(hours=start_hour)
+        if end_hour <= start_hour:
+            quiet_end = day + timedelta(days=1, hours=end_hour)
+        else:
+            quiet_end = day + timedelta(hours=end_hour)
+        if quiet_end > time_min and quiet_start < time_max:
+            busy_times.append((quiet_start, quiet_end))
+        day += timedelta(days=1)
+
+    return busy_times
+
+
+def user_busy_times(user, time_min, time_max, include_calendar=True, exclude_lesson_id=None):
+    busy_times = lesson_busy_times(user.id, time_min, time_max, exclude_lesson_id)
+    busy_times += quiet_busy_times(time_min, time_max)
+    if include_calendar:
+        busy_times += calendar_service.get_busy_times(time_min, time_max)
+    return calendar_service.merge_intervals(busy_times)
+
+
+def find_user_slots(user, count, duration_minutes=None, days=7, include_calendar=True,
+                    exclude_lesson_id=None, one_per_day=False):
+    duration_minutes = duration_minutes or user.lesson_duration or 30
+    now = datetime.utcnow()
+    busy_times = user_busy_times(user, now, now + timedelta(days=days), include_calendar, exclude_lesson_id)
+
+    return calendar_service.find_available_slots(
+        count,
+        duration_minutes,
+        parse_preferred_hour(user.preferred_time),
+        days=days,
+        busy_times=busy_times,
+        one_per_day=one_per_day
+    )
+
+
+def find_user_slot(user, duration_minutes=None, include_calendar=True, exclude_lesson_id=None):
+    slots = find_user_slots(
+        user,
+        1,
+        duration_minutes,
+        include_calendar=include_calendar,
+        exclude_lesson_id=exclude_lesson_id
+    )
+    return slots[0] if slots else None
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import timeit
+from datetime import date, datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='lango-bench-'), 'lango.db')}")
+os.environ.setdefault('SESSION_SECRET', 'benchmarks')
+os.environ.setdefault('REPL_ID', 'benchmarks')
+
+import calendar_service
+import gemini_service
+import routes
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_THRESHOLD = 1.5
+REPEAT = 5
+
+
+def calibration():
+    # A fixed mix of arithmetic, dict and string work. Results are stored as
+    # multiples of its run time, so a baseline recorded on one machine still
+    # means something on a faster or slower one.
+    values = list(range(2000))
+
+    def run():
+        total = 0
+        for value in values:
+            total += value * value % 7
+        index = {str(value): value for value in values[:500]}
+        return total, len(index)
+    return run
+
+
+def bench_sm2(size):
+    rng = random.Random(size)
+    cards = [(rng.randint(0, 5), rng.randint(0, 10), rng.uniform(1.3, 3.0), rng.randint(1, 90)) for _ in range(size)]
+
+    def run():
+        for quality, repetitions, ease_factor, interval in cards:
+            routes.calculate_sm2(quality, repetitions, ease_factor, interval)
+    return run
+
+
+def bench_streak(size):
+    today = date(2026, 1, 31)
+    dates = {today - timedelta(days=day) for day in range(size)}
+
+    def run():
+        routes.streak_from_dates(dates, today)
+    return run
+
+
+def bench_find_slots(size, count=1):
+    rng = random.Random(size)
+    now = datetime.utcnow()
+    busy_times = []
+    for _ in range(size):
+        start = now + timedelta(minutes=rng.randint(0, 7 * 24 * 60))
+        busy_times.append((start, start + timedelta(minutes=rng.choice([30, 60, 90]))))
+
+    def run():
+        calendar_service.find_available_slots(count, 30, busy_times=busy_times)
+    return run
+
+
+def bench_conversation_prompt(size):
+    vocabulary = [{'spanish': f"palabra{index}", 'english': f"word{index}"} for index in range(size)]
+    verbs = [{'infinitive': f"verbo{index}", 'english': f"verb{index}"} for index in range(size)]
+
+    def run():
+        gemini_service.get_conversation_prompt("Food", vocabulary, verbs, 2)
+    return run
+
+
+def bench_analyze_response(size):
+    text = ("¡Muy bien! Tu respuesta es correcta. " * (size // 36 + 1))[:size] + " [GOOD]"
+
+    def run():
+        gemini_service.analyze_ai_response(text)
+    return run
+
+
+def bench_difficulty_adjustment(size):
+    rng = random.Random(size)
+    sessions = [(rng.randint(0, 10), rng.randint(0, 10), rng.randint(1, 3)) for _ in range(size)]
+
+    def run():
+        for corrections, successes, level in sessions:
+            gemini_service.calculate_difficulty_adjustment(corrections, successes, level)
+    return run
+
+
+BENCHMARKS = [
+    ('calculate_sm2[reviews=100]', lambda: bench_sm2(100)),
+    ('calculate_sm2[reviews=10000]', lambda: bench_sm2(10000)),
+    ('streak_from_dates[days=7]', lambda: bench_streak(7)),
+    ('streak_from_dates[days=365]', lambda: bench_streak(365)),
+    ('find_available_slots[events=10]', lambda: bench_find_slots(10)),
+    ('find_available_slots[events=1000]', lambda: bench_find_slots(1000)),
+    ('find_available_slots[events=1000,slots=6]', lambda: bench_find_slots(1000, 6)),
+    ('get_conversation_prompt[words=10]', lambda: bench_conversation_prompt(10)),
+    ('get_conversation_prompt[words=100]', lambda: bench_conversation_prompt(100)),
+    ('get_conversation_prompt[words=1000]', lambda: bench_conversation_prompt(1000)),
+    ('analyze_ai_response[chars=200]', lambda: bench_analyze_response(200)),
+    ('analyze_ai_response[chars=20000]', lambda: bench_analyze_response(20000)),
+    ('calculate_difficulty_adjustment[sessions=1000]', lambda: bench_difficulty_adjustment(1000)),
+]
+
+
+def measure(func):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=REPEAT, number=number)) / number
+
+
+def run(selected=None):
+    unit = measure(calibration())
+    results = {}
+    for name, factory in BENCHMARKS:
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        results[name] = measure(factory()) / unit
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"{'benchmark':<50}{'current':>14}{'baseline':>14}{'ratio':>8}")
+    for name, units in results.items():
+        base = baseline.get(name)
+        ratio = units / base if base else None
+        print(f"{name:<50}{units:>14.4f}"
+              f"{(base if base else float('nan')):>14.4f}"
+              f"{(ratio if ratio else float('nan')):>8.2f}")
+        if ratio and ratio > threshold:
+            regressions.append(f"{name} is {ratio:.2f}x slower than baseline (threshold {threshold}x)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for Lango's hot pure functions")
+    parser.add_argument('-k', action='append', dest='selected', help="only run benchmarks whose name contains this")
+    parser.add_argument('--save-baseline', action='store_true', help="overwrite the stored baseline with this run")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="fail when a benchmark is this many times slower than its baseline")
+    args = parser.parse_args()
+
+    results = run(args.selected)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"baseline written to {BASELINE_PATH}")
+        regressions = []
+
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    sys.exit(1 if regressions else 0)
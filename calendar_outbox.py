@@ -0,0 +1,269 @@
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import aliased
+
+from app import app, db
+from models import CalendarOutbox, ScheduledLesson
+import calendar_service
+
+MAX_ATTEMPTS = 8
+BATCH_SIZE = 20
+POLL_INTERVAL_SECONDS = 5
+
+_wakeup = threading.Event()
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def new_event_id():
+    # Google accepts client-supplied ids made of base32hex characters, which
+    # lets a retried create be recognised as a duplicate instead of a new event.
+    return uuid.uuid4().hex
+
+
+def lesson_event_id(lesson):
+    if lesson.calendar_event_id:
+        return lesson.calendar_event_id
+
+    pending_create = CalendarOutbox.query.filter_by(
+        lesson_id=lesson.id,
+        operation='create',
+        status='pending'
+    ).order_by(CalendarOutbox.id.desc()).first()
+
+    return pending_create.event_id if pending_create else None
+
+
+def _enqueue(lesson, event_id, operation, payload):
+    if lesson.id is None:
+        db.session.flush()
+
+    entry = CalendarOutbox(
+        lesson_id=lesson.id,
+        event_id=event_id,
+        operation=operation,
+        payload=payload
+    )
+    db.session.add(entry)
+    return entry
+
+
+def enqueue_create(lesson, title, description=""):
+    return _enqueue(lesson, new_event_id(), 'create', {
+        'title': title,
+        'description': description,
+        'start_time': lesson.scheduled_time.isoformat(),
+        'duration_minutes': lesson.duration_minutes
+    })
+
+
+def enqueue_update(lesson):
+    event_id = lesson_event_id(lesson)
+    if not event_id:
+        return None
+
+    return _enqueue(lesson, event_id, 'update', {
+        'start_time': lesson.scheduled_time.isoformat(),
+        'duration_minutes': lesson.duration_minutes
+    })
+
+
+def enqueue_delete(lesson):
+    event_id = lesson_event_id(lesson)
+    if not event_id:
+        return None
+
+    return _enqueue(lesson, event_id, 'delete', {})
+
+
+def notify():
+    _wakeup.set()
+
+
+def _record_created(entry, created):
+    if not created:
+        return False
+    event_id, etag = created
+    ScheduledLesson.query.filter_by(id=entry.lesson_id).update(
+        {'calendar_event_id': event_id, 'calendar_etag': etag},
+        synchronize_session=False
+    )
+    return True
+
+
+def _apply_creates(entries):
+    events = []
+    for entry in entries:
+        payload = entry.payload or {}
+        events.append({
+            'title': payload.get('title'),
+            'start_time': datetime.fromisoformat(payload['start_time']),
+            'duration_minutes': payload.get('duration_minutes') or 30,
+            'description': payload.get('description', ''),
+            'event_id': entry.event_id
+        })
+
+    calendar_service.rate_limiter.acquire(len(events))
+    if len(events) == 1:
+        event_ids = [calendar_service.create_calendar_event(**events[0])]
+    else:
+        event_ids = calendar_service.batch_create_calendar_events(events)
+
+    return {entry.id: _record_created(entry, created) for entry, created in zip(entries, event_ids)}
+
+
+def _apply(entry):
+    payload = entry.payload or {}
+
+    if entry.operation in ('update', 'delete'):
+        calendar_service.rate_limiter.acquire()
+
+    if entry.operation == 'update':
+        return _apply_update(entry, datetime.fromisoformat(payload['start_time']), payload.get('duration_minutes'))
+
+    if entry.operation == 'delete':
+        return calendar_service.delete_calendar_event(entry.event_id)
+
+    logging.error(f"Unknown calendar outbox operation: {entry.operation}")
+    return False
+
+
+def _apply_update(entry, start_time, duration_minutes):
+    lesson = db.session.get(ScheduledLesson, entry.lesson_id)
+    etag = lesson.calendar_etag if lesson is not None else None
+    try:
+        new_etag = calendar_service.update_calendar_event(
+            entry.event_id, start_time=start_time, duration_minutes=duration_minutes, etag=etag
+        )
+    except calendar_service.CalendarConflict as conflict:
+        new_etag = _reconcile(entry, lesson, conflict.event, start_time, duration_minutes)
+    if new_etag is None:
+        return False
+    if lesson is not None:
+        lesson.calendar_etag = new_etag or None
+    return True
+
+
+def _reconcile(entry, lesson, event, start_time, duration_minutes):
+    # Someone edited the event in Google Calendar after our etag was taken.
+    # Whichever change was made last wins, instead of overwriting blindly.
+    remote_start = calendar_service.parse_event_time(event['start']['dateTime'])
+    if remote_start == start_time:
+        return event.get('etag') or ''
+
+    remote_updated = calendar_service.parse_event_time(event['updated'])
+    queued_at = entry.created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if remote_updated > queued_at:
+        # The calendar edit is newer than this reschedule, so the lesson
+        # follows the calendar.
+        if lesson is not None:
+            lesson.scheduled_time = remote_start
+            remote_end = calendar_service.parse_event_time(event['end']['dateTime'])
+            lesson.duration_minutes = int((remote_end - remote_start).total_seconds() // 60)
+        logging.warning(f"Calendar event {entry.event_id} was moved in Google Calendar after lesson "
+                        f"{entry.lesson_id} was rescheduled; keeping the calendar's time")
+        return event.get('etag') or ''
+
+    logging.warning(f"Calendar event {entry.event_id} changed before lesson {entry.lesson_id} was rescheduled; "
+                    f"applying the reschedule to the current version")
+    calendar_service.rate_limiter.acquire()
+    return calendar_service.update_calendar_event(
+        entry.event_id, start_time=start_time, duration_minutes=duration_minutes, etag=event.get('etag')
+    )
+
+
+def _retry_delay(attempts):
+    return timedelta(seconds=min(3600, 30 * 2 ** (attempts - 1)))
+
+
+def dispatch_pending(limit=BATCH_SIZE):
+    now = datetime.now()
+
+    # An entry only runs once every earlier entry for the same event has
+    # settled, so a delete can never overtake the create it depends on.
+    earlier = aliased(CalendarOutbox)
+    blocked = db.session.query(earlier.id).filter(
+        earlier.event_id == CalendarOutbox.event_id,
+        earlier.id < CalendarOutbox.id,
+        earlier.status == 'pending'
+    ).exists()
+
+    entries = CalendarOutbox.query.filter(
+        CalendarOutbox.status == 'pending',
+        CalendarOutbox.next_attempt_at <= now,
+        ~blocked
+    ).order_by(CalendarOutbox.id).limit(limit).with_for_update(skip_locked=True).all()
+
+    creates = [entry for entry in entries if entry.operation == 'create']
+    created = {}
+    create_error = None
+    if creates:
+        try:
+            created = _apply_creates(creates)
+        except Exception as e:
+            create_error = str(e)
+
+    for entry in entries:
+        try:
+            if entry.operation == 'create':
+                applied = created.get(entry.id, False)
+                error = create_error
+            else:
+                applied = _apply(entry)
+                error = None
+            if not applied and error is None:
+                error = "Calendar API call failed"
+        except Exception as e:
+            applied = False
+            error = str(e)
+
+        entry.attempts = (entry.attempts or 0) + 1
+        if applied:
+            entry.status = 'done'
+            entry.processed_at = datetime.now()
+            entry.last_error = None
+        elif entry.attempts >= MAX_ATTEMPTS:
+            entry.status = 'failed'
+            entry.processed_at = datetime.now()
+            entry.last_error = error
+            logging.error(f"Calendar {entry.operation} for event {entry.event_id} gave up after {entry.attempts} attempts: {error}")
+        else:
+            entry.next_attempt_at = datetime.now() + _retry_delay(entry.attempts)
+            entry.last_error = error
+            logging.warning(f"Calendar {entry.operation} for event {entry.event_id} failed, retrying: {error}")
+
+    db.session.commit()
+    return len(entries)
+
+
+def _run_dispatcher():
+    while True:
+        _wakeup.wait(POLL_INTERVAL_SECONDS)
+        _wakeup.clear()
+
+        with app.app_context():
+            try:
+                while dispatch_pending() == BATCH_SIZE:
+                    pass
+            except Exception as e:
+                logging.error(f"Calendar outbox dispatcher error: {e}")
+                db.session.rollback()
+
+
+def start_dispatcher():
+    global _dispatcher
+
+    with _dispatcher_lock:
+        if _dispatcher is not None and _dispatcher.is_alive():
+            return _dispatcher
+
+        _dispatcher = threading.Thread(
+            target=_run_dispatcher,
+            name='calendar-outbox-dispatcher',
+            daemon=True
+        )
+        _dispatcher.start()
+        return _dispatcher
@@ -1,10 +1,62 @@
 import os
+import re
+import json
+import uuid
 import logging
+import threading
+import time
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+import metrics
 
 connection_settings = None
 
+def new_http_session():
+    session = requests.Session()
+    session.hooks['response'].append(metrics.outbound_hook('calendar'))
+    return session
+
+
+http = new_http_session()
+
+# Per process: the nightly job and each web worker's outbox dispatcher space
+# their own Calendar requests.
+CALENDAR_RATE_LIMIT = float(os.environ.get('CALENDAR_RATE_LIMIT', 5))
+
+
+class RateLimiter:
+
+    def __init__(self, rate_per_second):
+        self.set_rate(rate_per_second)
+        self.next_allowed = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0
+
+    def acquire(self, requests=1):
+        # Batched requests count each item against the quota, so a batch
+        # reserves one interval per item.
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_allowed - now
+            self.next_allowed = max(now, self.next_allowed) + self.interval * requests
+        if wait > 0:
+            time.sleep(wait)
+
+
+rate_limiter = RateLimiter(CALENDAR_RATE_LIMIT)
+
+class CalendarConflict(Exception):
+    # The event changed in Google Calendar since its etag was stored.
+
+    def __init__(self, event):
+        super().__init__(f"Calendar event {event.get('id')} was changed elsewhere")
+        self.event = event
+
 
 def get_access_token():
     global connection_settings
@@ -28,7 +80,7 @@ def get_access_token():
         return None
     
     try:
-        response = requests.get(
+        response = http.get(
             f'https://{hostname}/api/v2/connection?include_secrets=true&connector_names=google-calendar',
             headers={
                 'Accept': 'application/json',
@@ -51,6 +103,13 @@ def get_access_token():
         return None
 
 
+def reset_connection():
+    global connection_settings, http, rate_limiter
+    connection_settings = None
+    http = new_http_session()
+    rate_limiter = RateLimiter(CALENDAR_RATE_LIMIT)
+
+
 def get_calendar_events(time_min=None, time_max=None):
     access_token = get_access_token()
     if not access_token:
@@ -62,7 +121,7 @@ def get_calendar_events(time_min=None, time_max=None):
         time_max = time_min + timedelta(days=7)
     
     try:
-        response = requests.get(
+        response = http.get(
             'https://www.googleapis.com/calendar/v3/calendars/primary/events',
             headers={
                 'Authorization': f'Bearer {access_token}',
@@ -82,15 +141,8 @@ def get_calendar_events(time_min=None, time_max=None):
         return []
 
 
-def find_available_slot(duration_minutes=30, preferred_hour=None):
-    access_token = get_access_token()
-    if not access_token:
-        return None
-    
-    now = datetime.utcnow()
-    end_search = now + timedelta(days=7)
-    
-    events = get_calendar_events(now, end_search)
+def get_busy_times(time_min, time_max):
+    events = get_calendar_events(time_min, time_max)
     
     busy_times = []
     for event in events:
@@ -109,37 +161,73 @@ def find_available_slot(duration_minutes=30, preferred_hour=None):
             except:
                 pass
     
+    return merge_intervals(busy_times)
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def find_available_slots(count, duration_minutes=30, preferred_hour=None, days=7, busy_times=None, one_per_day=False):
+    now = datetime.utcnow()
+    end_search = now + timedelta(days=days)
+    
+    if busy_times is None:
+        busy_times = get_busy_times(now, end_search)
+    
+    # Merged intervals are sorted with increasing ends, so a single cursor can
+    # sweep them alongside the candidate hours instead of rescanning per slot.
+    busy_times = merge_intervals(busy_times)
+    index = 0
+    slots = []
+    
     current = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
     
-    while current < end_search:
+    while current < end_search and len(slots) < count:
         hour = current.hour
         
-        if 6 <= hour <= 22:
-            if preferred_hour is not None and hour != preferred_hour:
-                current += timedelta(hours=1)
-                continue
-            
+        if 6 <= hour <= 22 and (preferred_hour is None or hour == preferred_hour):
             slot_end = current + timedelta(minutes=duration_minutes)
             
-            is_available = True
-            for busy_start, busy_end in busy_times:
-                if not (slot_end <= busy_start or current >= busy_end):
-                    is_available = False
-                    break
+            while index < len(busy_times) and busy_times[index][1] <= current:
+                index += 1
             
-            if is_available:
-                return current
+            if index == len(busy_times) or slot_end <= busy_times[index][0]:
+                slots.append(current)
+                if one_per_day:
+                    current = current.replace(hour=0) + timedelta(days=1)
+                    continue
+                current = slot_end
+                if current.minute or current.second:
+                    current = current.replace(minute=0, second=0) + timedelta(hours=1)
+                continue
         
         current += timedelta(hours=1)
     
-    return None
+    return slots
 
 
-def create_calendar_event(title, start_time, duration_minutes=30, description=""):
+def find_available_slot(duration_minutes=30, preferred_hour=None):
     access_token = get_access_token()
     if not access_token:
         return None
     
+    slots = find_available_slots(1, duration_minutes, preferred_hour)
+    return slots[0] if slots else None
+
+
+BATCH_URL = 'https://www.googleapis.com/batch/calendar/v3'
+BATCH_LIMIT = 50
+
+
+def build_event(title, start_time, duration_minutes=30, description="", event_id=None):
     end_time = start_time + timedelta(minutes=duration_minutes)
     
     event = {
@@ -154,9 +242,20 @@ def create_calendar_event(title, start_time, duration_minutes=30, description=""
             'timeZone': 'UTC'
         }
     }
+    if event_id:
+        event['id'] = event_id
+    return event
+
+
+def create_calendar_event(title, start_time, duration_minutes=30, description="", event_id=None):
+    access_token = get_access_token()
+    if not access_token:
+        return None
+    
+    event = build_event(title, start_time, duration_minutes, description, event_id)
     
     try:
-        response = requests.post(
+        response = http.post(
             'https://www.googleapis.com/calendar/v3/calendars/primary/events',
             headers={
                 'Authorization': f'Bearer {access_token}',
@@ -165,71 +264,180 @@ def create_calendar_event(title, start_time, duration_minutes=30, description=""
             },
             json=event
         )
+        if event_id and response.status_code == 409:
+            return event_id, None
         data = response.json()
-        return data.get('id')
+        return (data['id'], data.get('etag')) if data.get('id') else None
     except Exception as e:
         logging.error(f"Error creating calendar event: {e}")
         return None
 
 
+def _encode_batch(events, boundary):
+    parts = []
+    for index, event in enumerate(events):
+        parts.append(
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <item{index}>\r\n"
+            "\r\n"
+            "POST /calendar/v3/calendars/primary/events HTTP/1.1\r\n"
+            "Content-Type: application/json\r\n"
+            "\r\n"
+            f"{json.dumps(event)}\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n")
+    return ''.join(parts)
+
+
+def _decode_batch(response, count):
+    results = [None] * count
+    content_type = response.headers.get('Content-Type', '')
+    if 'boundary=' not in content_type:
+        return results
+    
+    boundary = content_type.split('boundary=', 1)[1].strip().strip('"')
+    for part in response.text.split(f"--{boundary}"):
+        match = re.search(r'Content-ID:\s*<response-item(\d+)>', part)
+        status = re.search(r'HTTP/1\.1 (\d{3})', part)
+        if not match or not status:
+            continue
+        
+        index = int(match.group(1))
+        if index >= count:
+            continue
+        
+        body = part[part.find('{'):part.rfind('}') + 1] if '{' in part else ''
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+        results[index] = (int(status.group(1)), data)
+    return results
+
+
+def batch_create_calendar_events(events):
+    access_token = get_access_token()
+    if not access_token:
+        return [None] * len(events)
+    
+    event_ids = []
+    for offset in range(0, len(events), BATCH_LIMIT):
+        chunk = events[offset:offset + BATCH_LIMIT]
+        bodies = [build_event(**event) for event in chunk]
+        boundary = f"batch_{uuid.uuid4().hex}"
+        
+        try:
+            response = http.post(
+                BATCH_URL,
+                headers={
+                    'Authorization': f'Bearer {access_token}',
+                    'Content-Type': f'multipart/mixed; boundary={boundary}'
+                },
+                data=_encode_batch(bodies, boundary).encode('utf-8')
+            )
+            results = _decode_batch(response, len(chunk))
+        except Exception as e:
+            logging.error(f"Error creating calendar events in batch: {e}")
+            results = [None] * len(chunk)
+        
+        for event, result in zip(chunk, results):
+            if result is None:
+                event_ids.append(None)
+                continue
+            status, data = result
+            if status == 409 and event.get('event_id'):
+                event_ids.append((event['event_id'], None))
+            elif status in [200, 201] and data.get('id'):
+                event_ids.append((data['id'], data.get('etag')))
+            else:
+                logging.error(f"Failed to create event in batch: {status}")
+                event_ids.append(None)
+    
+    return event_ids
+
+
 def is_calendar_connected():
     return get_access_token() is not None
 
 
-def update_calendar_event(event_id, title=None, start_time=None, duration_minutes=None, description=None):
+def parse_event_time(value):
+    # Google returns RFC 3339 with an offset or "Z"; lessons are naive UTC.
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _fetch_event(access_token, event_id):
+    response = http.get(
+        f'https://www.googleapis.com/calendar/v3/calendars/primary/events/{event_id}',
+        headers={
+            'Authorization': f'Bearer {access_token}',
+            'Accept': 'application/json'
+        },
+        params={'fields': 'id,etag,start,end,updated'}
+    )
+    
+    if response.status_code != 200:
+        logging.error(f"Failed to get event after a conflict: {response.status_code}")
+        return None
+    return response.json()
+
+
+def update_calendar_event(event_id, title=None, start_time=None, duration_minutes=None, description=None, etag=None):
+    # Returns the event's new etag, or None on failure. With an etag the PATCH
+    # is conditional, and a 412 raises CalendarConflict carrying the current
+    # event instead of overwriting someone else's change.
     access_token = get_access_token()
     if not access_token or not event_id:
-        return False
+        return None
+    
+    changes = {}
+    if title:
+        changes['summary'] = title
+    if description:
+        changes['description'] = description
+    if start_time:
+        end_time = start_time + timedelta(minutes=duration_minutes or 30)
+        changes['start'] = {
+            'dateTime': start_time.isoformat(),
+            'timeZone': 'UTC'
+        }
+        changes['end'] = {
+            'dateTime': end_time.isoformat(),
+            'timeZone': 'UTC'
+        }
+    
+    if not changes:
+        return etag or ''
+    
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    }
+    if etag:
+        headers['If-Match'] = etag
     
     try:
-        response = requests.get(
-            f'https://www.googleapis.com/calendar/v3/calendars/primary/events/{event_id}',
-            headers={
-                'Authorization': f'Bearer {access_token}',
-                'Accept': 'application/json'
-            }
-        )
-        
-        if response.status_code != 200:
-            logging.error(f"Failed to get event for update: {response.status_code}")
-            return False
-        
-        existing_event = response.json()
-        
-        if title:
-            existing_event['summary'] = title
-        if description:
-            existing_event['description'] = description
-        if start_time:
-            end_time = start_time + timedelta(minutes=duration_minutes or 30)
-            existing_event['start'] = {
-                'dateTime': start_time.isoformat(),
-                'timeZone': 'UTC'
-            }
-            existing_event['end'] = {
-                'dateTime': end_time.isoformat(),
-                'timeZone': 'UTC'
-            }
-        
-        update_response = requests.put(
+        update_response = http.patch(
             f'https://www.googleapis.com/calendar/v3/calendars/primary/events/{event_id}',
-            headers={
-                'Authorization': f'Bearer {access_token}',
-                'Accept': 'application/json',
-                'Content-Type': 'application/json'
-            },
-            json=existing_event
+            headers=headers,
+            params={'fields': 'id,etag'},
+            json=changes
         )
-        
-        if update_response.status_code == 200:
-            return True
-        else:
-            logging.error(f"Failed to update event: {update_response.status_code}")
-            return False
-            
     except Exception as e:
         logging.error(f"Error updating calendar event: {e}")
-        return False
+        return None
+    
+    if update_response.status_code == 200:
+        return update_response.json().get('etag') or ''
+    
+    if update_response.status_code == 412:
+        current = _fetch_event(access_token, event_id)
+        if current is not None:
+            raise CalendarConflict(current)
+    
+    logging.error(f"Failed to update event: {update_response.status_code}")
+    return None
 
 
 def delete_calendar_event(event_id):
@@ -238,14 +446,14 @@ def delete_calendar_event(event_id):
         return False
     
     try:
-        response = requests.delete(
+        response = http.delete(
             f'https://www.googleapis.com/calendar/v3/calendars/primary/events/{event_id}',
             headers={
                 'Authorization': f'Bearer {access_token}'
             }
         )
         
-        if response.status_code in [200, 204]:
+        if response.status_code in [200, 204, 404, 410]:
             return True
         else:
             logging.error(f"Failed to delete event: {response.status_code}")
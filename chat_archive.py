@@ -0,0 +1,233 @@
+import argparse
+import json
+import logging
+import os
+import re
+import zlib
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import exists, func, text
+
+from app import app, db
+from models import ChatSession, ChatMessage, ChatSessionStats, ChatMessageArchive
+
+CHAT_ARCHIVE_AFTER_DAYS = int(os.environ.get('CHAT_ARCHIVE_AFTER_DAYS', 90))
+CHAT_ARCHIVE_BATCH_SIZE = int(os.environ.get('CHAT_ARCHIVE_BATCH_SIZE', 200))
+PARTITION_MONTHS_AHEAD = int(os.environ.get('CHAT_PARTITION_MONTHS_AHEAD', 3))
+
+PARTITION_NAME = re.compile(r'^chat_messages_y(\d{4})m(\d{2})$')
+
+
+def record_session_stats(chat_session, role_counts=None):
+    if role_counts is None:
+        role_counts = dict(db.session.query(ChatMessage.role, func.count(ChatMessage.id)).filter(
+            ChatMessage.session_id == chat_session.id
+        ).group_by(ChatMessage.role))
+    db.session.merge(ChatSessionStats(
+        session_id=chat_session.id,
+        user_id=chat_session.user_id,
+        message_count=sum(role_counts.values()),
+        user_message_count=role_counts.get('user', 0),
+        assistant_message_count=role_counts.get('assistant', 0)
+    ))
+
+
+def archive_sessions(older_than_days=CHAT_ARCHIVE_AFTER_DAYS, batch_size=CHAT_ARCHIVE_BATCH_SIZE):
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    archived = 0
+    while True:
+        sessions = ChatSession.query.filter(
+            ChatSession.ended_at != None,
+            ChatSession.ended_at < cutoff,
+            ~exists().where(ChatMessageArchive.session_id == ChatSession.id)
+        ).order_by(ChatSession.id).limit(batch_size).all()
+        if not sessions:
+            break
+
+        session_ids = [s.id for s in sessions]
+        messages_by_session = {}
+        for message in ChatMessage.query.filter(ChatMessage.session_id.in_(session_ids)).order_by(
+            ChatMessage.session_id, ChatMessage.created_at, ChatMessage.id
+        ):
+            messages_by_session.setdefault(message.session_id, []).append(message)
+
+        for chat_session in sessions:
+            messages = messages_by_session.get(chat_session.id, [])
+            rows = [[m.role, m.content, m.created_at.isoformat() if m.created_at else None] for m in messages]
+            db.session.add(ChatMessageArchive(
+                session_id=chat_session.id,
+                message_count=len(rows),
+                payload=zlib.compress(json.dumps(rows, ensure_ascii=False).encode('utf-8'), 9)
+            ))
+            role_counts = {}
+            for m in messages:
+                role_counts[m.role] = role_counts.get(m.role, 0) + 1
+            record_session_stats(chat_session, role_counts)
+
+        ChatMessage.query.filter(ChatMessage.session_id.in_(session_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        archived += len(sessions)
+        logging.info(f"Archived messages of {archived} chat sessions ended before {cutoff:%Y-%m-%d}")
+
+    if db.engine.dialect.name == 'postgresql':
+        drop_empty_partitions(date(cutoff.year, cutoff.month, 1))
+    return archived
+
+
+def backfill_stats():
+    missing = db.session.query(ChatSession.id, ChatSession.user_id).filter(
+        ChatSession.ended_at != None,
+        ~exists().where(ChatSessionStats.session_id == ChatSession.id)
+    ).all()
+    if not missing:
+        return 0
+
+    counts = {}
+    session_ids = [session_id for session_id, _ in missing]
+    for start in range(0, len(session_ids), 500):
+        rows = db.session.query(ChatMessage.session_id, ChatMessage.role, func.count(ChatMessage.id)).filter(
+            ChatMessage.session_id.in_(session_ids[start:start + 500])
+        ).group_by(ChatMessage.session_id, ChatMessage.role)
+        for session_id, role, count in rows:
+            counts.setdefault(session_id, {})[role] = count
+
+    db.session.add_all([
+        ChatSessionStats(
+            session_id=session_id,
+            user_id=user_id,
+            message_count=sum(counts.get(session_id, {}).values()),
+            user_message_count=counts.get(session_id, {}).get('user', 0),
+            assistant_message_count=counts.get(session_id, {}).get('assistant', 0)
+        )
+        for session_id, user_id in missing
+    ])
+    db.session.commit()
+    return len(missing)
+
+
+def _month_start(day, offset=0):
+    month = day.month - 1 + offset
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _partitions(conn):
+    rows = conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = 'chat_messages'"
+    ))
+    return [row[0] for row in rows]
+
+
+def ensure_partitions(conn, first_month=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    current = _month_start(date.today())
+    month = first_month or current
+    while month <= _month_start(current, months_ahead):
+        next_month = _month_start(month, 1)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS chat_messages_y{month.year}m{month.month:02d} "
+            f"PARTITION OF chat_messages FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        ))
+        month = next_month
+    # Catches rows outside the prepared months (clock skew, a missed cron run)
+    # instead of failing the insert.
+    conn.execute(text("CREATE TABLE IF NOT EXISTS chat_messages_default PARTITION OF chat_messages DEFAULT"))
+
+
+def drop_empty_partitions(before_month):
+    with db.engine.begin() as conn:
+        for name in _partitions(conn):
+            match = PARTITION_NAME.match(name)
+            if not match or _month_start(date(int(match.group(1)), int(match.group(2)), 1), 1) > before_month:
+                continue
+            if conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})")).scalar():
+                continue
+            conn.execute(text(f"DROP TABLE {name}"))
+            logging.info(f"Dropped empty chat message partition {name}")
+
+
+def partition_messages():
+    if db.engine.dialect.name != 'postgresql':
+        # SQLite has no declarative partitioning; archival alone keeps the
+        # table small there, so only make sure its indexes exist.
+        for index in ChatMessage.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        return False
+
+    with db.engine.begin() as conn:
+        partitioned = conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+            "JOIN pg_class ON pg_class.oid = pg_partitioned_table.partrelid "
+            "WHERE pg_class.relname = 'chat_messages')"
+        )).scalar()
+        if partitioned:
+            ensure_partitions(conn)
+            return True
+
+        conn.execute(text("LOCK TABLE chat_messages IN ACCESS EXCLUSIVE MODE"))
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence('chat_messages', 'id')")).scalar()
+        oldest = conn.execute(text("SELECT min(created_at) FROM chat_messages")).scalar()
+
+        conn.execute(text("ALTER TABLE chat_messages RENAME TO chat_messages_unpartitioned"))
+        # Index names share the schema namespace, so free them for the new table.
+        conn.execute(text("ALTER INDEX IF EXISTS chat_messages_pkey RENAME TO chat_messages_unpartitioned_pkey"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_chat_messages_session_created"))
+        # The partition key has to be part of the primary key.
+        conn.execute(text(
+            "CREATE TABLE chat_messages (LIKE chat_messages_unpartitioned INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (created_at)"
+        ))
+        conn.execute(text("ALTER TABLE chat_messages ADD PRIMARY KEY (id, created_at)"))
+        conn.execute(text(
+            "ALTER TABLE chat_messages ADD FOREIGN KEY (session_id) REFERENCES chat_sessions (id)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX ix_chat_messages_session_created ON chat_messages (session_id, created_at)"
+        ))
+        ensure_partitions(conn, _month_start(oldest) if oldest else None)
+
+        copied = conn.execute(text(
+            "INSERT INTO chat_messages (id, session_id, role, content, created_at) "
+            "SELECT id, session_id, role, content, COALESCE(created_at, now()) FROM chat_messages_unpartitioned"
+        )).rowcount
+        original = conn.execute(text("SELECT count(*) FROM chat_messages_unpartitioned")).scalar()
+        if copied != original:
+            # Raising rolls the whole conversion back, renames included.
+            raise RuntimeError(f"Copied {copied} of {original} chat messages; chat_messages left unpartitioned")
+        if sequence:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY chat_messages.id"))
+        # The old table no longer receives writes; it stays until an operator
+        # has checked the new one and drops it, and loses its foreign key so
+        # it never blocks changes to chat_sessions meanwhile.
+        conn.execute(text(
+            "ALTER TABLE chat_messages_unpartitioned DROP CONSTRAINT IF EXISTS chat_messages_session_id_fkey"
+        ))
+    logging.info(
+        f"Converted {copied} chat messages to monthly range partitions; "
+        f"drop chat_messages_unpartitioned once the application has been checked against the new table"
+    )
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partition, archive and summarise chat messages")
+    parser.add_argument('--partition', action='store_true',
+                        help="convert chat_messages to monthly partitions (PostgreSQL) and create upcoming months")
+    parser.add_argument('--archive', action='store_true',
+                        help="move messages of old ended sessions into compressed per-session archives")
+    parser.add_argument('--older-than-days', type=int, default=CHAT_ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--backfill-stats', action='store_true',
+                        help="compute message counters for ended sessions that have none")
+    args = parser.parse_args()
+
+    if not (args.partition or args.archive or args.backfill_stats):
+        parser.print_help()
+
+    with app.app_context():
+        if args.partition:
+            partition_messages()
+        if args.backfill_stats:
+            print(f"Computed message counters for {backfill_stats()} sessions")
+        if args.archive:
+            print(f"Archived {archive_sessions(args.older_than_days)} sessions")
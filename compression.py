@@ -0,0 +1,150 @@
+import os
+import zlib
+
+from werkzeug.datastructures import Headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'application/x-ndjson', 'image/svg+xml',
+}
+# Hashed static files already ship with .gz/.br variants picked by assets.py.
+SKIP_PATH_PREFIXES = ('/static/dist/',)
+
+
+def accepted_encodings(header):
+    accepted = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+    return {name for name, quality in accepted.items() if quality > 0}
+
+
+def negotiate(header):
+    accepted = accepted_encodings(header)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+class GzipStream:
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def write(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliStream:
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def write(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+STREAMS = {'gzip': GzipStream, 'br': BrotliStream}
+
+
+def should_compress(status, headers):
+    if status[:3] in ('204', '206', '304') or 'Content-Encoding' in headers:
+        return False
+    if 'no-transform' in headers.get('Cache-Control', ''):
+        return False
+    mimetype = headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+    # text/event-stream is deliberately absent: proxies and browsers handle
+    # SSE best uncompressed.
+    if mimetype not in COMPRESSIBLE_TYPES:
+        return False
+    length = headers.get('Content-Length')
+    # Streamed bodies have no length yet and are compressed chunk by chunk.
+    return length is None or int(length) >= COMPRESSION_MIN_SIZE
+
+
+class CompressionMiddleware:
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+        if (encoding is None or environ.get('REQUEST_METHOD') == 'HEAD'
+                or environ.get('PATH_INFO', '').startswith(SKIP_PATH_PREFIXES)):
+            return self.wsgi_app(environ, start_response)
+
+        captured = {}
+
+        def capturing_start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            captured['exc_info'] = exc_info
+            return lambda data: captured.setdefault('written', []).append(data)
+
+        app_iter = self.wsgi_app(environ, capturing_start_response)
+        return self.respond(app_iter, encoding, captured, start_response)
+
+    def respond(self, app_iter, encoding, captured, start_response):
+        try:
+            headers = Headers(captured['headers'])
+            written = captured.get('written', [])
+
+            if not should_compress(captured['status'], headers):
+                start_response(captured['status'], captured['headers'], captured['exc_info'])
+                yield from written
+                yield from app_iter
+                return
+
+            headers['Content-Encoding'] = encoding
+            headers.remove('Content-Length')
+            vary = headers.get('Vary')
+            headers['Vary'] = f"{vary}, Accept-Encoding" if vary else 'Accept-Encoding'
+            etag = headers.get('ETag')
+            if etag and not etag.startswith('W/'):
+                # The encoded bytes differ from the identity representation.
+                headers['ETag'] = f"W/{etag}"
+            start_response(captured['status'], headers.to_wsgi_list(), captured['exc_info'])
+
+            # Each chunk is sync-flushed so streamed responses reach the
+            # client as they are produced instead of waiting for the end.
+            stream = STREAMS[encoding]()
+            for chunk in written:
+                yield stream.write(chunk)
+            for chunk in app_iter:
+                if chunk:
+                    yield stream.write(chunk)
+            yield stream.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+def init_app(app):
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app)
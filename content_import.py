@@ -0,0 +1,417 @@
+import argparse
+import csv
+import hashlib
+import html
+import io
+import json
+import logging
+import os
+import re
+import time
+
+from sqlalchemy import func, update
+
+from app import app, db
+from models import LessonCategory, Vocabulary, Verb, ContentPack
+
+CONTENT_IMPORT_CHUNK_SIZE = int(os.environ.get('CONTENT_IMPORT_CHUNK_SIZE', 5000))
+# A pack rejecting more than this share of its rows is almost certainly in
+# the wrong format, so nothing from it is kept.
+CONTENT_IMPORT_MAX_REJECT_RATE = float(os.environ.get('CONTENT_IMPORT_MAX_REJECT_RATE', 0.2))
+MAX_LOGGED_REJECTS = 20
+JSON_READ_SIZE = 64 * 1024
+
+FORMATS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'ndjson', '.ndjson': 'ndjson', '.txt': 'anki', '.tsv': 'anki'}
+
+CONJUGATIONS = ['yo', 'tu', 'el_ella', 'nosotros', 'vosotros', 'ellos']
+VOCABULARY_FIELDS = ['spanish_word', 'english_word', 'pronunciation', 'example_sentence']
+VERB_FIELDS = ['infinitive', 'english_meaning', *CONJUGATIONS, 'example_sentence']
+# Column limits from models.py; example sentences are Text.
+MAX_LENGTH = 100
+
+ALIASES = {
+    'type': 'kind',
+    'spanish_word': 'spanish',
+    'infinitive': 'spanish',
+    'english_word': 'english',
+    'english_meaning': 'english',
+    'example_sentence': 'example',
+    'tú': 'tu',
+    'él_ella': 'el_ella',
+    'el/ella': 'el_ella',
+    'ellos_ellas': 'ellos',
+}
+
+ANKI_SEPARATORS = {'tab': '\t', 'comma': ',', 'semicolon': ';', 'pipe': '|', 'space': ' ', 'colon': ':'}
+HTML_TAG = re.compile(r'<[^>]+>')
+HTML_BREAK = re.compile(r'<br\s*/?>', re.IGNORECASE)
+JSON_SPACE = re.compile(r'\s*')
+
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _normalize(record):
+    row = {}
+    for key, value in record.items():
+        if key is None:
+            continue
+        key = key.strip().lower().replace(' ', '_')
+        key = ALIASES.get(key, key)
+        # JSON packs give order as a number; everything else is text.
+        row[key] = value if key == 'order' and not isinstance(value, str) else _clean(value)
+    row['kind'] = (row.get('kind') or 'vocabulary').lower()
+    return row
+
+
+def read_csv(lines):
+    for line_number, record in enumerate(csv.DictReader(lines), start=2):
+        yield line_number, _normalize(record)
+
+
+def read_ndjson(lines):
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, {'error': f"invalid JSON ({e.msg})"}
+            continue
+        if not isinstance(record, dict):
+            yield line_number, {'error': "expected one JSON object per line"}
+            continue
+        yield line_number, _normalize(record)
+
+
+def read_json(stream):
+    # A JSON array is decoded one element at a time from a sliding buffer, so
+    # memory stays bounded by the largest record instead of the whole file.
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    line_number = 1
+    at_end = False
+
+    def next_char():
+        # Skips whitespace, reading more of the file as needed; returns the
+        # next character or '' at the end of the file.
+        nonlocal buffer, position, line_number, at_end
+        while True:
+            end = JSON_SPACE.match(buffer, position).end()
+            line_number += buffer.count('\n', position, end)
+            position = end
+            if position < len(buffer) or at_end:
+                return buffer[position:position + 1]
+            chunk = stream.read(JSON_READ_SIZE)
+            at_end = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+    if next_char() != '[':
+        raise ValueError("expected a JSON array of objects (use --format ndjson for one object per line)")
+    position += 1
+    if next_char() == ']':
+        return
+
+    while True:
+        while True:
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+                break
+            except ValueError as e:
+                if at_end:
+                    line_number += buffer.count('\n', position, e.pos)
+                    raise ValueError(f"invalid JSON on line {line_number} ({e.msg})")
+                chunk = stream.read(JSON_READ_SIZE)
+                at_end = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+
+        if isinstance(record, dict):
+            yield line_number, _normalize(record)
+        else:
+            yield line_number, {'error': "expected a JSON object"}
+        line_number += buffer.count('\n', position, end)
+        position = end
+
+        separator = next_char()
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f"invalid JSON on line {line_number} (expected ',' or ']')")
+        position += 1
+        next_char()
+
+
+def _anki_text(value):
+    return html.unescape(HTML_TAG.sub('', value or '')).strip()
+
+
+def read_anki(lines, category=None):
+    # Anki's text export: optional "#key:value" header lines, then one note
+    # per line with Front, Back and any extra fields.
+    options = {}
+    in_header = True
+    for line_number, line in enumerate(lines, start=1):
+        if in_header:
+            if line.startswith('#'):
+                key, _, value = line[1:].partition(':')
+                options[key.strip().lower()] = value.strip()
+                continue
+            separator = options.get('separator', 'tab')
+            separator = ANKI_SEPARATORS.get(separator.lower(), separator[:1] or '\t')
+            tags_column = int(options['tags column']) - 1 if options.get('tags column', '').isdigit() else None
+            deck = category or options.get('deck', '').split('::')[-1].strip() or 'Imported'
+            in_header = False
+
+        fields = next(csv.reader([line], delimiter=separator))
+        if tags_column is not None and tags_column < len(fields):
+            fields.pop(tags_column)
+        if not any(field.strip() for field in fields):
+            continue
+        back = HTML_BREAK.split(fields[1]) if len(fields) > 1 else ['']
+        yield line_number, {
+            'kind': 'vocabulary',
+            'category': deck,
+            'spanish': _clean(_anki_text(fields[0])),
+            'english': _clean(_anki_text(back[0])),
+            'pronunciation': _clean(_anki_text(back[1])) if len(back) > 1 else None,
+            'example': _clean(_anki_text(fields[2])) if len(fields) > 2 else None,
+        }
+
+
+def validate(row):
+    if 'error' in row:
+        return row['error']
+    if row['kind'] == 'category':
+        if not row.get('name') and not row.get('category'):
+            return "category record without a name"
+        if row.get('order') is not None:
+            try:
+                int(row['order'])
+            except (TypeError, ValueError):
+                return f"order {row['order']!r} is not a whole number"
+        return None
+    if row['kind'] not in ('vocabulary', 'verb'):
+        return f"unknown type {row['kind']!r}"
+    for field in ('category', 'spanish', 'english'):
+        if not row.get(field):
+            return f"missing {field}"
+    for field in ('category', 'spanish', 'english', 'pronunciation', *CONJUGATIONS):
+        if row.get(field) is not None and len(str(row[field])) > MAX_LENGTH:
+            return f"{field} longer than {MAX_LENGTH} characters"
+    return None
+
+
+def _copy(table, columns, rows):
+    # COPY streams the whole chunk in one round trip, far faster than even
+    # batched INSERTs; it runs on the session's connection and transaction.
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+class PackImporter:
+
+    def __init__(self, chunk_size=CONTENT_IMPORT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.use_copy = db.session.get_bind().dialect.name == 'postgresql'
+        self.categories = {name: category_id for category_id, name in db.session.query(LessonCategory.id, LessonCategory.name)}
+        self.next_order = (db.session.query(func.max(LessonCategory.order)).scalar() or 0) + 1
+        self.created_categories = 0
+        # Existing rows per (model, category): key -> (id, values), loaded the
+        # first time a category is touched so unchanged rows can be skipped.
+        self.existing = {}
+        self.seen = set()
+        self.inserts = {Vocabulary: [], Verb: []}
+        self.updates = {Vocabulary: [], Verb: []}
+        self.counts = {Vocabulary: 0, Verb: 0}
+        self.rows = 0
+        self.rejected = 0
+
+    def category_id(self, name, metadata=None):
+        category_id = self.categories.get(name)
+        if category_id is None:
+            category = LessonCategory(name=name, icon='book', order=self.next_order)
+            self.next_order += 1
+            db.session.add(category)
+            db.session.flush()
+            category_id = self.categories[name] = category.id
+            self.created_categories += 1
+        if metadata:
+            db.session.execute(update(LessonCategory).where(LessonCategory.id == category_id).values(**metadata))
+        return category_id
+
+    def existing_rows(self, model, category_id):
+        key = (model, category_id)
+        if key not in self.existing:
+            fields = VOCABULARY_FIELDS if model is Vocabulary else VERB_FIELDS
+            columns = [getattr(model, field) for field in fields]
+            self.existing[key] = {
+                row[1]: (row[0], tuple(row[1:]))
+                for row in db.session.query(model.id, *columns).filter(model.category_id == category_id)
+            }
+        return self.existing[key]
+
+    def reject(self, line_number, reason):
+        self.rejected += 1
+        if self.rejected <= MAX_LOGGED_REJECTS:
+            logging.warning(f"Skipping line {line_number}: {reason}")
+
+    def add(self, line_number, row):
+        self.rows += 1
+        error = validate(row)
+        if error:
+            self.reject(line_number, error)
+            return
+
+        if row['kind'] == 'category':
+            metadata = {field: row[field] for field in ('description', 'icon', 'order') if row.get(field) is not None}
+            if 'order' in metadata:
+                metadata['order'] = int(metadata['order'])
+            self.category_id(row.get('name') or row['category'], metadata)
+            return
+
+        category_id = self.category_id(row['category'])
+        if row['kind'] == 'verb':
+            model = Verb
+            values = (row['spanish'], row['english'], *[row.get(field) for field in CONJUGATIONS], row.get('example'))
+            fields = VERB_FIELDS
+        else:
+            model = Vocabulary
+            values = (row['spanish'], row['english'], row.get('pronunciation'), row.get('example'))
+            fields = VOCABULARY_FIELDS
+
+        if (model, category_id, row['spanish']) in self.seen:
+            self.reject(line_number, f"duplicate {row['kind']} {row['spanish']!r} in {row['category']!r}")
+            return
+        self.seen.add((model, category_id, row['spanish']))
+
+        existing = self.existing_rows(model, category_id).get(row['spanish'])
+        if existing is None:
+            self.inserts[model].append((*values, category_id))
+        elif existing[1] != values:
+            self.updates[model].append({'id': existing[0], **dict(zip(fields, values))})
+        else:
+            return
+        self.counts[model] += 1
+
+        if len(self.inserts[model]) + len(self.updates[model]) >= self.chunk_size:
+            self.flush(model)
+
+    def flush(self, model):
+        fields = VOCABULARY_FIELDS if model is Vocabulary else VERB_FIELDS
+        columns = [*fields, 'category_id']
+        inserts, updates = self.inserts[model], self.updates[model]
+        if inserts:
+            if self.use_copy:
+                _copy(model.__tablename__, columns, inserts)
+            else:
+                db.session.execute(model.__table__.insert(), [dict(zip(columns, row)) for row in inserts])
+        if updates:
+            db.session.execute(update(model), updates)
+        self.inserts[model], self.updates[model] = [], []
+
+    def finish(self):
+        self.flush(Vocabulary)
+        self.flush(Verb)
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'ndjson': read_ndjson, 'anki': read_anki}
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def import_pack(path, name=None, version=None, fmt=None, category=None, chunk_size=CONTENT_IMPORT_CHUNK_SIZE,
+                max_reject_rate=CONTENT_IMPORT_MAX_REJECT_RATE):
+    stem, extension = os.path.splitext(os.path.basename(path))
+    name = name or stem
+    fmt = fmt or FORMATS.get(extension.lower())
+    if fmt not in READERS:
+        raise ValueError(f"Cannot tell the format of {path}; pass --format")
+
+    checksum = file_checksum(path)
+    latest = ContentPack.query.filter_by(name=name).order_by(ContentPack.version.desc()).first()
+    if latest is not None and latest.checksum == checksum:
+        logging.info(f"Content pack {name} v{latest.version} is already imported")
+        return latest
+    if version is None:
+        version = latest.version + 1 if latest else 1
+    elif latest is not None and version <= latest.version:
+        raise ValueError(f"Content pack {name} is already at version {latest.version}")
+
+    started = time.perf_counter()
+    importer = PackImporter(chunk_size)
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            rows = read_anki(f, category) if fmt == 'anki' else READERS[fmt](f)
+            for line_number, row in rows:
+                if category and row.get('kind') != 'category':
+                    row['category'] = category
+                importer.add(line_number, row)
+        importer.finish()
+        if not importer.rows:
+            raise ValueError(f"{path} has no rows")
+        if importer.rejected > importer.rows * max_reject_rate or importer.rejected == importer.rows:
+            raise ValueError(f"Rejected {importer.rejected} of {importer.rows} rows in {path}; nothing was imported")
+    except Exception:
+        # Chunks already flushed are part of the open transaction, so this
+        # leaves neither content nor a pack record behind.
+        db.session.rollback()
+        raise
+
+    # The pack row commits with the content, so a failed import leaves
+    # neither behind and can simply be rerun.
+    pack = ContentPack(
+        name=name,
+        version=version,
+        checksum=checksum,
+        category_count=importer.created_categories,
+        vocabulary_count=importer.counts[Vocabulary],
+        verb_count=importer.counts[Verb],
+        rejected_count=importer.rejected
+    )
+    db.session.add(pack)
+    db.session.commit()
+    logging.info(
+        f"Imported content pack {name} v{version}: {pack.vocabulary_count} vocabulary, {pack.verb_count} verbs, "
+        f"{pack.category_count} new categories, {pack.rejected_count} rejected rows "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+    return pack
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a vocabulary and verb content pack")
+    parser.add_argument('path', help="CSV, JSON array, newline-delimited JSON or Anki text export")
+    parser.add_argument('--name', help="pack name used for versioning (default: file name)")
+    parser.add_argument('--version', type=int, help="pack version (default: latest imported + 1)")
+    parser.add_argument('--format', choices=sorted(READERS))
+    parser.add_argument('--category', help="put every row in this category")
+    parser.add_argument('--chunk-size', type=int, default=CONTENT_IMPORT_CHUNK_SIZE)
+    parser.add_argument('--max-reject-rate', type=float, default=CONTENT_IMPORT_MAX_REJECT_RATE,
+                        help="abort without importing anything when more than this share of rows is rejected")
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            pack = import_pack(args.path, args.name, args.version, args.format, args.category, args.chunk_size,
+                               args.max_reject_rate)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"{pack.name} v{pack.version}: {pack.vocabulary_count} vocabulary, {pack.verb_count} verbs, "
+              f"{pack.rejected_count} rejected")
@@ -0,0 +1,54 @@
+import logging
+import os
+
+from flask import g, request
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import NullPool
+
+import metrics
+
+# queue: a per-process pool sized from the settings below.
+# pgbouncer: PgBouncer in transaction mode owns pooling, so every checkout
+# opens a fresh (cheap) connection to it and returns it straight after.
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'queue')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 5)))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 300))
+
+# pessimistic: ping every connection on checkout.
+# optimistic: skip the ping, rely on recycling, and when a dropped connection
+# surfaces mid-request let SQLAlchemy invalidate the pool and retry idempotent
+# requests once.
+DB_DISCONNECT_STRATEGY = os.environ.get('DB_DISCONNECT_STRATEGY', 'optimistic')
+
+RETRYABLE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def engine_options():
+    if DB_POOL_MODE == 'pgbouncer':
+        return {'poolclass': NullPool}
+
+    return {
+        'poolclass': metrics.InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_DISCONNECT_STRATEGY == 'pessimistic',
+    }
+
+
+def init_app(app, db):
+    if DB_POOL_MODE == 'pgbouncer' or DB_DISCONNECT_STRATEGY != 'optimistic':
+        return
+
+    @app.errorhandler(DBAPIError)
+    def retry_after_disconnect(error):
+        if not error.connection_invalidated or request.method not in RETRYABLE_METHODS or g.get('db_retried'):
+            raise error
+
+        g.db_retried = True
+        logging.warning(f"Database connection dropped during {request.endpoint}; retrying on a fresh connection")
+        db.session.rollback()
+        return app.ensure_sync(app.view_functions[request.endpoint])(**request.view_args)
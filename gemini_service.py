@@ -1,22 +1,34 @@
 import os
 import logging
+import threading
 from google import genai
 from google.genai import types
 
+import metrics
+
 client = None
+_client_lock = threading.Lock()
 
 def get_client():
     global client
     api_key = os.environ.get("GEMINI_API_KEY")
     if api_key and client is None:
-        try:
-            client = genai.Client(api_key=api_key)
-        except Exception as e:
-            logging.error(f"Failed to initialize Gemini client: {e}")
-            client = None
+        with _client_lock:
+            if client is None:
+                try:
+                    client = genai.Client(api_key=api_key)
+                except Exception as e:
+                    logging.error(f"Failed to initialize Gemini client: {e}")
+                    client = None
     return client
 
 
+def reset_client():
+    global client, _client_lock
+    client = None
+    _client_lock = threading.Lock()
+
+
 def get_difficulty_guidelines(difficulty_level):
     if difficulty_level == 1:
         return {
@@ -135,15 +147,16 @@ def chat_with_ai(messages, category_name, vocabulary_words, verbs, difficulty_le
             role = "user" if msg['role'] == 'user' else "model"
             contents.append(types.Content(role=role, parts=[types.Part(text=msg['content'])]))
         
-        response = gemini_client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=contents,
-            config=types.GenerateContentConfig(
-                system_instruction=system_prompt,
-                temperature=0.7,
-                max_output_tokens=500,
-            ),
-        )
+        with metrics.track_outbound('gemini'):
+            response = gemini_client.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=contents,
+                config=types.GenerateContentConfig(
+                    system_instruction=system_prompt,
+                    temperature=0.7,
+                    max_output_tokens=500,
+                ),
+            )
         
         return response.text if response.text else "Lo siento, I couldn't generate a response. Please try again."
     
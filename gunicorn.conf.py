@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # The app is imported in the master before forking, so sockets, locks and
+    # threads must already be cooperative by then.
+    from gevent import monkey
+    monkey.patch_all()
+
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+# Background threads are started per worker in post_fork, never in the master.
+os.environ['LANGO_PRELOAD'] = '1'
+os.environ.setdefault('TEMPLATES_AUTO_RELOAD', '0')
+os.environ.setdefault('METRICS_DIR', '/tmp/lango-metrics')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+preload_app = True
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    # Worker snapshots from a previous run would be added to this one's totals.
+    import glob
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], '*.json')):
+        os.remove(path)
+
+
+def when_ready(server):
+    # Templates compiled and the search index built in the preloaded master
+    # are inherited by every worker, so none of them pays for it on a request.
+    from app import app
+    import search_index
+    import template_cache
+    if template_cache.TEMPLATE_WARMUP:
+        template_cache.warm_up(app)
+    with app.app_context():
+        search_index.warm_up()
+
+
+def post_fork(server, worker):
+    import worker as lango_worker
+    lango_worker.init_worker()
+
+
+def child_exit(server, worker):
+    import metrics
+    if metrics.METRICS_DIR:
+        metrics.retire_worker(worker.pid)
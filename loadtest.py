@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser(description="Drive a realistic route mix against Lango and report latency per route")
+parser.add_argument('--users', type=int, default=20)
+parser.add_argument('--requests', type=int, default=2000, help="total requests across all workers")
+parser.add_argument('--concurrency', type=int, default=16)
+parser.add_argument('--reviews-per-user', type=int, default=60)
+parser.add_argument('--sessions-per-user', type=int, default=20)
+parser.add_argument('--messages-per-session', type=int, default=12)
+parser.add_argument('--gemini-latency', type=float, default=0.3, help="seconds the fake Gemini backend takes per reply")
+parser.add_argument('--calendar-latency', type=float, default=0.1, help="seconds the fake Calendar backend takes per call")
+parser.add_argument('--database-url', default=None, help="defaults to a throwaway SQLite file")
+parser.add_argument('--output', default='loadtest_results.json')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+if args.database_url:
+    os.environ['DATABASE_URL'] = args.database_url
+else:
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='lango-loadtest-'), 'lango.db')}"
+os.environ.setdefault('SESSION_SECRET', 'loadtest')
+os.environ.setdefault('REPL_ID', 'loadtest')
+
+import requests
+from werkzeug.serving import make_server
+
+from app import app, db
+import main  # noqa: F401  registers routes and seeds lesson content
+import activity
+import chat_archive
+import calendar_service
+import gemini_service
+from models import (User, LessonCategory, Vocabulary, UserProgress, ChatSession,
+                    ChatMessage, VocabularyReview)
+
+ROUTE_MIX = [
+    ('dashboard', 'GET', '/dashboard', 20),
+    ('progress', 'GET', '/progress', 10),
+    ('progress_data', 'GET', '/progress/data', 10),
+    ('review', 'GET', '/review', 12),
+    ('review_card', 'GET', '/review/card/{review_id}', 8),
+    ('rate_review', 'POST', '/review/rate/{review_id}', 8),
+    ('lesson', 'GET', '/lesson/{category_id}', 10),
+    ('vocabulary_lesson', 'GET', '/lesson/{category_id}/vocabulary', 6),
+    ('conversation', 'GET', '/lesson/{category_id}/conversation', 8),
+    ('send_message', 'POST', '/lesson/{category_id}/conversation/send', 8),
+    ('schedule', 'GET', '/schedule', 6),
+    ('add_schedule', 'POST', '/schedule/add', 4),
+]
+
+
+class FakeGeminiModels:
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, model, contents, config):
+        time.sleep(self.latency)
+        reply = random.choice(["[GOOD] ¡Muy bien! ¿Y qué más?", "[CORRECTION] Se dice \"estoy\", no \"soy\"."])
+        return type('FakeResponse', (), {'text': reply})()
+
+
+class FakeGeminiClient:
+
+    def __init__(self, latency):
+        self.models = FakeGeminiModels(latency)
+
+
+class FakeCalendarResponse:
+
+    def __init__(self, status_code, data=None, text=None, content_type='application/json'):
+        self.status_code = status_code
+        self.data = data or {}
+        self.headers = {'Content-Type': content_type}
+        self.text = json.dumps(self.data) if text is None else text
+
+    def json(self):
+        return self.data
+
+
+class FakeCalendarSession:
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def _respond(self, status_code, data=None, **kwargs):
+        time.sleep(self.latency)
+        return FakeCalendarResponse(status_code, data, **kwargs)
+
+    def _batch(self, body):
+        # Answers every inner create the way Google's batch endpoint does:
+        # one application/http part per request, matched by Content-ID.
+        request_boundary = body.split('\r\n', 1)[0]
+        boundary = f"batch_{random.getrandbits(64):x}"
+        parts = []
+        for index, part in enumerate(body.split(request_boundary)[1:-1]):
+            event = json.loads(part[part.find('{'):part.rfind('}') + 1])
+            created = {'id': event.get('id', f"fake-event-{index}"), 'etag': '"fake"'}
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-item{index}>\r\n"
+                "\r\n"
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: application/json\r\n"
+                "\r\n"
+                f"{json.dumps(created)}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        return self._respond(200, text=''.join(parts), content_type=f"multipart/mixed; boundary={boundary}")
+
+    def get(self, url, **kwargs):
+        if url.endswith('/events'):
+            return self._respond(200, {'items': []})
+        return self._respond(200, {'etag': '"fake"'})
+
+    def post(self, url, **kwargs):
+        if url == calendar_service.BATCH_URL:
+            return self._batch(kwargs['data'].decode('utf-8'))
+        event = kwargs.get('json') or {}
+        return self._respond(200, {'id': event.get('id', 'fake-event'), 'etag': '"fake"'})
+
+    def patch(self, url, **kwargs):
+        return self._respond(200, {'etag': '"fake"'})
+
+    def delete(self, url, **kwargs):
+        return self._respond(204)
+
+
+def install_fakes():
+    fake_gemini = FakeGeminiClient(args.gemini_latency)
+    gemini_service.get_client = lambda: fake_gemini
+    calendar_service.get_access_token = lambda: 'fake-token'
+    calendar_service.http = FakeCalendarSession(args.calendar_latency)
+
+
+def seed_users():
+    now = datetime.now()
+    users = []
+    with app.app_context():
+        categories = [c.id for c in LessonCategory.query.order_by(LessonCategory.order).all()]
+        vocab_ids = [row.id for row in db.session.query(Vocabulary.id)]
+
+        for index in range(args.users):
+            user = User(id=f"loadtest-user-{index}", onboarding_complete=True, lesson_duration=30,
+                        calendar_connected=True)
+            db.session.add(user)
+
+            for category_id in categories[:random.randint(1, len(categories))]:
+                db.session.add(UserProgress(user_id=user.id, category_id=category_id,
+                                            vocabulary_completed=True, conversation_completed=True,
+                                            completed_at=now))
+
+            reviews = []
+            for vocab_id in random.sample(vocab_ids, min(args.reviews_per_user, len(vocab_ids))):
+                last_reviewed = now - timedelta(days=random.randint(0, 30))
+                reviews.append(VocabularyReview(
+                    user_id=user.id,
+                    vocabulary_id=vocab_id,
+                    repetitions=random.randint(0, 7),
+                    interval_days=random.randint(1, 30),
+                    last_reviewed=last_reviewed,
+                    next_review_date=now + timedelta(days=random.randint(-3, 10))
+                ))
+            db.session.add_all(reviews)
+
+            for session_index in range(args.sessions_per_user):
+                ended_at = now - timedelta(days=random.randint(0, 60))
+                chat_session = ChatSession(user_id=user.id, category_id=random.choice(categories),
+                                           started_at=ended_at - timedelta(minutes=15), ended_at=ended_at,
+                                           corrections_count=random.randint(0, 5),
+                                           successful_responses=random.randint(0, 10))
+                db.session.add(chat_session)
+                db.session.flush()
+                db.session.add_all([ChatMessage(
+                    session_id=chat_session.id,
+                    role='user' if message_index % 2 else 'assistant',
+                    content=f"Mensaje de prueba número {message_index}"
+                ) for message_index in range(args.messages_per_session)])
+
+            db.session.commit()
+            users.append({
+                'id': user.id,
+                'review_ids': [review.id for review in reviews],
+                'categories': categories
+            })
+        activity.backfill()
+        chat_archive.backfill_stats()
+    return users
+
+
+def login_cookie(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+        session['_fresh'] = True
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+    return cookie.value
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run(base_url, users):
+    cookies = {user['id']: login_cookie(user['id']) for user in users}
+    weights = [weight for _, _, _, weight in ROUTE_MIX]
+    results = {name: {'latencies': [], 'errors': 0} for name, _, _, _ in ROUTE_MIX}
+    results_lock = threading.Lock()
+    local = threading.local()
+
+    def one_request(_):
+        if not hasattr(local, 'http'):
+            local.http = requests.Session()
+        user = random.choice(users)
+        name, method, path, _ = random.choices(ROUTE_MIX, weights)[0]
+        url = base_url + path.format(
+            review_id=random.choice(user['review_ids']) if user['review_ids'] else 0,
+            category_id=random.choice(user['categories'])
+        )
+        data = None
+        if name == 'send_message':
+            data = {'message': 'Hola, me gusta la comida mexicana'}
+        elif name == 'rate_review':
+            data = {'quality': random.randint(0, 5)}
+        elif name == 'add_schedule':
+            data = {'category_id': random.choice(user['categories']), 'schedule_type': 'auto'}
+
+        # Each request impersonates a random user, so nothing may leak between
+        # them through the connection's cookie jar.
+        local.http.cookies.clear()
+        started = time.perf_counter()
+        try:
+            response = local.http.request(method, url, data=data, allow_redirects=False,
+                                          cookies={app.config['SESSION_COOKIE_NAME']: cookies[user['id']]})
+            failed = response.status_code >= 400
+        except requests.RequestException:
+            failed = True
+        elapsed = time.perf_counter() - started
+
+        with results_lock:
+            results[name]['latencies'].append(elapsed)
+            if failed:
+                results[name]['errors'] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one_request, range(args.requests)))
+    wall_seconds = time.perf_counter() - started
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': vars(args),
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(args.requests / wall_seconds, 2),
+        'routes': {}
+    }
+    for name, data in results.items():
+        latencies = sorted(data['latencies'])
+        if not latencies:
+            continue
+        report['routes'][name] = {
+            'requests': len(latencies),
+            'errors': data['errors'],
+            'throughput_rps': round(len(latencies) / wall_seconds, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"{'route':<20}{'reqs':>7}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in sorted(report['routes'].items()):
+        print(f"{name:<20}{stats['requests']:>7}{stats['errors']:>8}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    print(f"total: {args.requests} requests in {report['wall_seconds']}s ({report['throughput_rps']} req/s)")
+
+
+if __name__ == "__main__":
+    random.seed(args.seed)
+    install_fakes()
+    users = seed_users()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        report = run(f"http://127.0.0.1:{server.server_port}", users)
+    finally:
+        server.shutdown()
+
+    print_report(report)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+    sys.exit(1 if any(stats['errors'] for stats in report['routes'].values()) else 0)
@@ -0,0 +1,163 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# "sqlalchemy.engine=0.01,urllib3=0.1" keeps that fraction of DEBUG records
+# from each logger (and its children); other levels are never sampled.
+LOG_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, rate in (pair.split('=', 1) for pair in os.environ.get('LOG_SAMPLE_RATES', '').split(',') if '=' in pair)
+}
+
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,128}$')
+RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+log_queue = queue.Queue(-1)
+_listener = None
+
+
+class RequestContextFilter(logging.Filter):
+
+    def filter(self, record):
+        # Runs on the thread that logged, before the record is queued, so the
+        # request id is still reachable.
+        if has_request_context() and 'request_id' in g:
+            record.request_id = g.request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or not self.rates:
+            return True
+        name = record.name
+        while name:
+            if name in self.rates:
+                return random.random() < self.rates[name]
+            name = name.rpartition('.')[0]
+        return True
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record):
+        # The stock handler flattens the record into a pre-formatted string;
+        # keep the extra fields and send the traceback as text instead.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def install_handler():
+    global log_queue
+    log_queue = queue.Queue(-1)
+    handler = StructuredQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    handler.addFilter(RequestContextFilter())
+    logging.getLogger().handlers = [handler]
+
+
+def start_listener():
+    global _listener
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_listener():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def reset_after_fork():
+    # The queue inherited from a preloading parent may have been forked while
+    # its listener thread held the queue's lock, and that thread does not
+    # survive fork, so each worker logs through a fresh queue and listener.
+    install_handler()
+    start_listener()
+
+
+def configure():
+    if _listener is not None:
+        return
+
+    install_handler()
+    logging.getLogger().setLevel(LOG_LEVEL)
+
+    start_listener()
+    atexit.register(stop_listener)
+
+
+def start_request():
+    supplied = request.headers.get(REQUEST_ID_HEADER, '')
+    g.request_id = supplied if REQUEST_ID_PATTERN.match(supplied) else uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+
+
+def init_app(app):
+    app.before_request(start_request)
+
+    @app.after_request
+    def log_request(response):
+        if 'request_started' not in g:
+            return response
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+        logging.getLogger('lango.request').info(
+            f"{request.method} {request.path} {response.status_code}",
+            extra={
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'duration_ms': round((time.perf_counter() - g.request_started) * 1000, 2),
+            }
+        )
+        return response
@@ -0,0 +1,318 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, request, abort
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from werkzeug.wsgi import ClosingIterator
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+POOL_WAIT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+# With several worker processes each one writes its registry here and
+# /metrics serves the sum, whichever worker answers the scrape.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+
+DEFAULT_QUERY_BUDGET = int(os.environ.get('DEFAULT_QUERY_BUDGET', 25))
+QUERY_BUDGETS = {
+    'dashboard': 8,
+    'progress': 10,
+    'progress_data': 8,
+    'review': 6,
+    'send_message': 13,
+    'conversation': 6,
+    'lesson': 6,
+    'schedule': 5,
+    'search_vocabulary': 4,
+}
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {
+                    key: (h.buckets, list(h.counts), h.total, h.count) for key, h in self.histograms.items()
+                },
+            }
+
+
+def render(snapshot):
+    lines = []
+    seen = set()
+    for (name, labels), value in sorted(snapshot['counters'].items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} counter")
+            seen.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), value in sorted(snapshot['gauges'].items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} gauge")
+            seen.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), (buckets, counts, total, count) in sorted(snapshot['histograms'].items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} histogram")
+            seen.add(name)
+        for bound, bucket_count in zip(buckets, counts):
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {bucket_count}")
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{str(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+registry = Registry()
+_request_stats = threading.local()
+_last_flush = 0.0
+
+
+def _encode(series):
+    return [[name, [list(pair) for pair in labels], value] for (name, labels), value in series.items()]
+
+
+def _decode(series):
+    return {(name, tuple(tuple(pair) for pair in labels)): value for name, labels, value in series}
+
+
+def _worker_path(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def flush():
+    global _last_flush
+    _last_flush = time.monotonic()
+    snapshot = registry.snapshot()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _worker_path(os.getpid())
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump({kind: _encode(series) for kind, series in snapshot.items()}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def maybe_flush():
+    if METRICS_DIR and time.monotonic() - _last_flush >= METRICS_FLUSH_SECONDS:
+        flush()
+
+
+def merged_snapshot():
+    # Counters and histograms add up across workers, and so do the pool
+    # gauges (connections checked out by the whole server).
+    merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        try:
+            with open(path) as f:
+                snapshot = {kind: _decode(series) for kind, series in json.load(f).items()}
+        except (OSError, ValueError):
+            continue
+        for kind in ('counters', 'gauges'):
+            for key, value in snapshot[kind].items():
+                merged[kind][key] = merged[kind].get(key, 0) + value
+        for key, (buckets, counts, total, count) in snapshot['histograms'].items():
+            current = merged['histograms'].get(key)
+            if current is None:
+                merged['histograms'][key] = (tuple(buckets), counts, total, count)
+            else:
+                merged['histograms'][key] = (
+                    current[0], [a + b for a, b in zip(current[1], counts)], current[2] + total, current[3] + count
+                )
+    return merged
+
+
+def retire_worker(pid):
+    # A dead worker's counters stay in the totals (they must never go
+    # backwards), but its gauges describe connections that no longer exist.
+    path = _worker_path(pid)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    data['gauges'] = []
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(data, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def current_stats():
+    return getattr(_request_stats, 'stats', None)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_start_time'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats['queries'] += 1
+        stats['query_seconds'] += time.perf_counter() - started
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    if context.is_disconnect:
+        registry.increment('lango_db_disconnects_total', {})
+
+
+class InstrumentedQueuePool(QueuePool):
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            registry.increment('lango_db_pool_timeouts_total', {})
+            raise
+        finally:
+            registry.observe('lango_db_pool_wait_seconds', {}, time.perf_counter() - started, POOL_WAIT_BUCKETS)
+            registry.set('lango_db_pool_checked_out', {}, self.checkedout())
+            registry.set('lango_db_pool_overflow', {}, max(self.overflow(), 0))
+
+
+@contextmanager
+def track_outbound(service):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe('lango_outbound_request_duration_seconds', {'service': service}, time.perf_counter() - started)
+
+
+def outbound_hook(service):
+    def hook(response, *args, **kwargs):
+        registry.observe(
+            'lango_outbound_request_duration_seconds',
+            {'service': service},
+            response.elapsed.total_seconds()
+        )
+    return hook
+
+
+class MetricsMiddleware:
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        stats = _request_stats.stats = {'queries': 0, 'query_seconds': 0.0}
+        started = time.perf_counter()
+        status_holder = {}
+
+        def recording_start_response(status, headers, exc_info=None):
+            status_holder['status'] = status.split(' ', 1)[0]
+            return start_response(status, headers, exc_info)
+
+        def finish():
+            _request_stats.stats = None
+            self.record(environ, status_holder.get('status', '500'), time.perf_counter() - started, stats)
+
+        try:
+            app_iter = self.wsgi_app(environ, recording_start_response)
+        except BaseException:
+            finish()
+            raise
+        # Recorded when the server closes the body, so the queries and time
+        # of streamed responses (exports) are included.
+        return ClosingIterator(app_iter, finish)
+
+    def record(self, environ, status, elapsed, stats):
+        route = environ.get('lango.endpoint') or 'unmatched'
+        method = environ.get('REQUEST_METHOD', 'GET')
+
+        registry.increment('lango_http_requests_total', {'route': route, 'method': method, 'status': status})
+        registry.observe('lango_http_request_duration_seconds', {'route': route, 'method': method}, elapsed)
+        registry.observe('lango_http_request_sql_queries', {'route': route}, stats['queries'], QUERY_COUNT_BUCKETS)
+        registry.increment('lango_sql_query_duration_seconds_total', {'route': route}, stats['query_seconds'])
+
+        budget = QUERY_BUDGETS.get(route, DEFAULT_QUERY_BUDGET)
+        if stats['queries'] > budget:
+            logging.warning(
+                f"Route {route} ran {stats['queries']} SQL queries (budget {budget}); "
+                f"possible N+1 query pattern"
+            )
+        maybe_flush()
+
+
+def metrics_view():
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        abort(403)
+    if METRICS_DIR:
+        flush()
+        snapshot = merged_snapshot()
+    else:
+        snapshot = registry.snapshot()
+    return Response(render(snapshot), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    @app.before_request
+    def record_endpoint():
+        request.environ['lango.endpoint'] = request.endpoint
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app)
@@ -99,9 +99,15 @@ class ScheduledLesson(db.Model):
     scheduled_time = db.Column(db.DateTime, nullable=False)
     duration_minutes = db.Column(db.Integer, default=30)
     calendar_event_id = db.Column(db.String)
+    # Google's etag for the event as last written, sent as If-Match on updates.
+    calendar_etag = db.Column(db.String(64))
     completed = db.Column(db.Boolean, default=False)
     
     category = db.relationship('LessonCategory')
+    
+    __table_args__ = (
+        db.Index('ix_scheduled_lessons_user_time', 'user_id', 'scheduled_time'),
+    )
 
 
 class ChatSession(db.Model):
@@ -127,6 +133,27 @@ class ChatMessage(db.Model):
     role = db.Column(db.String(20), nullable=False)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        db.Index('ix_chat_messages_session_created', 'session_id', 'created_at'),
+    )
+
+
+class ChatSessionStats(db.Model):
+    __tablename__ = 'chat_session_stats'
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), primary_key=True)
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    user_message_count = db.Column(db.Integer, nullable=False, default=0)
+    assistant_message_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ChatMessageArchive(db.Model):
+    __tablename__ = 'chat_message_archives'
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), primary_key=True)
+    message_count = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.now)
 
 
 class VocabularyReview(db.Model):
@@ -146,3 +173,55 @@ class VocabularyReview(db.Model):
     __table_args__ = (
         UniqueConstraint('user_id', 'vocabulary_id', name='uq_user_vocabulary_review'),
     )
+
+
+class CalendarOutbox(db.Model):
+    __tablename__ = 'calendar_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    lesson_id = db.Column(db.Integer, nullable=False)
+    event_id = db.Column(db.String(64), nullable=False)
+    operation = db.Column(db.String(20), nullable=False)  # create, update, delete
+    payload = db.Column(db.JSON, default=dict)
+    status = db.Column(db.String(20), default='pending')  # pending, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    processed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_calendar_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+        db.Index('ix_calendar_outbox_event_id', 'event_id'),
+    )
+
+
+class ServerSession(db.Model):
+    __tablename__ = 'server_sessions'
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class DailyActivity(db.Model):
+    __tablename__ = 'daily_activity'
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    reviews = db.Column(db.Integer, nullable=False, default=0)
+    conversations = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ContentPack(db.Model):
+    __tablename__ = 'content_packs'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    checksum = db.Column(db.String(64), nullable=False)
+    category_count = db.Column(db.Integer, nullable=False, default=0)
+    vocabulary_count = db.Column(db.Integer, nullable=False, default=0)
+    verb_count = db.Column(db.Integer, nullable=False, default=0)
+    rejected_count = db.Column(db.Integer, nullable=False, default=0)
+    imported_at = db.Column(db.DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        UniqueConstraint('name', 'version', name='uq_content_pack_version'),
+    )
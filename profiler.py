@@ -0,0 +1,147 @@
+import cProfile
+import hmac
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILE_HEADER = 'X-Lango-Profile'
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/lango-profiles')
+PROFILE_RING_SIZE = int(os.environ.get('PROFILE_RING_SIZE', 50))
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+
+slow_query_log = logging.getLogger('lango.slow_query')
+
+# cProfile hooks are process-wide on newer Pythons, so only one request is
+# profiled at a time; concurrent requests simply skip capture.
+_profile_lock = threading.Lock()
+_ring_lock = threading.Lock()
+
+
+def should_profile():
+    if PROFILE_TOKEN:
+        supplied = request.headers.get(PROFILE_HEADER, '')
+        if supplied and hmac.compare_digest(supplied, PROFILE_TOKEN):
+            return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def start_profile():
+    if not should_profile() or not _profile_lock.acquire(blocking=False):
+        return
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        _profile_lock.release()
+        return
+    g.profile = profile
+
+
+def stop_profile():
+    profile = g.pop('profile', None)
+    if profile is None:
+        return None
+    try:
+        profile.disable()
+    finally:
+        _profile_lock.release()
+    return write_profile(profile, request.endpoint or 'unmatched')
+
+
+def write_profile(profile, endpoint):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    filename = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{endpoint}.prof"
+    path = os.path.join(PROFILE_DIR, filename)
+    profile.dump_stats(path)
+
+    with _ring_lock:
+        profiles = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.prof'))
+        for name in profiles[:-PROFILE_RING_SIZE]:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name))
+            except OSError:
+                pass
+
+    logging.info(f"Wrote request profile for {endpoint} to {path}")
+    return path
+
+
+def explain(cursor, statement, parameters, dialect_name):
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect_name == 'sqlite' else 'EXPLAIN '
+    explain_cursor = cursor.connection.cursor()
+    # On PostgreSQL a failed statement aborts the whole transaction, so the
+    # EXPLAIN runs in a savepoint that is rolled back if it fails.
+    savepoint = dialect_name == 'postgresql'
+    try:
+        if savepoint:
+            explain_cursor.execute("SAVEPOINT lango_explain")
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            plan = "\n".join(" ".join(str(column) for column in row) for row in explain_cursor.fetchall())
+        except Exception:
+            if savepoint:
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT lango_explain")
+            raise
+        if savepoint:
+            explain_cursor.execute("RELEASE SAVEPOINT lango_explain")
+        return plan
+    finally:
+        explain_cursor.close()
+
+
+def describe_parameters(parameters, executemany):
+    # Bound values can be session ids or token lookup keys, so only their
+    # shape is logged.
+    if executemany:
+        return f"{len(parameters)} parameter sets"
+    values = parameters.values() if isinstance(parameters, dict) else (parameters or ())
+    return f"{len(values)} ({', '.join(type(value).__name__ for value in values)})"
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('slow_query_start_time', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info['slow_query_start_time'].pop()) * 1000
+    if elapsed_ms < SLOW_QUERY_THRESHOLD_MS:
+        return
+
+    plan = None
+    if not executemany and statement.lstrip().upper().startswith('SELECT'):
+        try:
+            plan = explain(cursor, statement, parameters, conn.dialect.name)
+        except Exception as e:
+            plan = f"EXPLAIN failed: {e}"
+
+    slow_query_log.warning(
+        f"Slow query ({elapsed_ms:.1f}ms): {statement}\n"
+        f"Parameters: {describe_parameters(parameters, executemany)}\nPlan:\n{plan}"
+    )
+
+
+def init_app(app):
+    app.before_request(start_profile)
+
+    @app.after_request
+    def finish_profile(response):
+        path = stop_profile()
+        if path:
+            response.headers['X-Lango-Profile-File'] = os.path.basename(path)
+        return response
+
+    @app.teardown_request
+    def release_profile(exc):
+        if 'profile' in g:
+            stop_profile()
@@ -0,0 +1,178 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix='lango-query-budgets-'), 'lango.db')
+os.environ['DATABASE_URL'] = f"sqlite:///{DATABASE_PATH}"
+os.environ.setdefault('SESSION_SECRET', 'query-budget-check')
+os.environ.setdefault('REPL_ID', 'query-budget-check')
+os.environ.pop('REPL_IDENTITY', None)
+os.environ.pop('WEB_REPL_RENEWAL', None)
+
+from sqlalchemy import event
+
+from app import app, db
+import main  # noqa: F401  registers routes and seeds lesson content
+import calendar_service
+import gemini_service
+import metrics
+import replit_auth
+import routes
+from models import (User, LessonCategory, Vocabulary, UserProgress, ScheduledLesson,
+                    ChatSession, ChatMessage, VocabularyReview)
+
+FIXTURE_SIZES = (1, 10, 50)
+VOCABULARY_PER_SIZE = 20
+MESSAGES_PER_SESSION = 10
+
+# Per-user data caches; they are emptied before each measured request so the
+# queries behind them are counted instead of the cache hit.
+DATA_CACHES = [routes.progress_data_cache, replit_auth.token_cache]
+
+ROUTES = [
+    ('dashboard', 'GET', '/dashboard'),
+    ('progress', 'GET', '/progress'),
+    ('progress_data', 'GET', '/progress/data'),
+    ('review', 'GET', '/review'),
+    ('lesson', 'GET', '/lesson/{category_id}'),
+    ('schedule', 'GET', '/schedule'),
+    ('conversation', 'GET', '/lesson/{category_id}/conversation'),
+    ('send_message', 'POST', '/lesson/{category_id}/conversation/send'),
+    ('search_vocabulary', 'GET', '/search?q=adios'),
+]
+
+
+def add_extra_vocabulary(count):
+    categories = LessonCategory.query.order_by(LessonCategory.order).all()
+    db.session.add_all([Vocabulary(
+        spanish_word=f"palabra {index}",
+        english_word=f"word {index}",
+        category_id=categories[index % len(categories)].id
+    ) for index in range(count)])
+    db.session.commit()
+
+
+def create_fixture_user(size):
+    now = datetime.now()
+    user = User(id=f"budget-user-{size}", onboarding_complete=True, lesson_duration=30)
+    db.session.add(user)
+
+    categories = LessonCategory.query.order_by(LessonCategory.order).all()
+    for category in categories:
+        db.session.add(UserProgress(
+            user_id=user.id,
+            category_id=category.id,
+            vocabulary_completed=True,
+            verbs_completed=True,
+            conversation_completed=True,
+            completed_at=now
+        ))
+
+    vocab_ids = [row.id for row in db.session.query(Vocabulary.id).order_by(Vocabulary.id).limit(size * VOCABULARY_PER_SIZE)]
+    for index, vocab_id in enumerate(vocab_ids):
+        db.session.add(VocabularyReview(
+            user_id=user.id,
+            vocabulary_id=vocab_id,
+            repetitions=index % 7,
+            last_reviewed=now - timedelta(days=index % 7),
+            next_review_date=now - timedelta(hours=1)
+        ))
+
+    for index in range(size):
+        category = categories[index % len(categories)]
+        chat_session = ChatSession(
+            user_id=user.id,
+            category_id=category.id,
+            started_at=now - timedelta(days=index, minutes=20),
+            ended_at=now - timedelta(days=index)
+        )
+        db.session.add(chat_session)
+        db.session.flush()
+        db.session.add_all([ChatMessage(
+            session_id=chat_session.id,
+            role='user' if message_index % 2 else 'assistant',
+            content=f"Mensaje {message_index}"
+        ) for message_index in range(MESSAGES_PER_SESSION)])
+
+        db.session.add(ScheduledLesson(
+            user_id=user.id,
+            category_id=category.id,
+            scheduled_time=now + timedelta(days=index + 1),
+            duration_minutes=30
+        ))
+
+    db.session.commit()
+    return user.id
+
+
+def count_queries(client, method, url):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        if method == 'POST':
+            response = client.post(url, data={'message': 'Hola, me llamo Ana'})
+        else:
+            response = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    if response.status_code >= 400:
+        raise RuntimeError(f"{method} {url} returned {response.status_code}")
+    return len(statements)
+
+
+def measure(user_id, category_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+        session['_fresh'] = True
+
+    counts = {}
+    for endpoint, method, url in ROUTES:
+        url = url.format(category_id=category_id)
+        # The first hit warms per-process caches (templates, compiled
+        # statements); the second is the steady state with cold data caches.
+        count_queries(client, method, url)
+        for cache in DATA_CACHES:
+            cache.clear()
+        counts[endpoint] = count_queries(client, method, url)
+    return counts
+
+
+def run():
+    calendar_service.get_access_token = lambda: None
+    gemini_service.chat_with_ai = lambda *args, **kwargs: "[GOOD] ¡Muy bien!"
+
+    with app.app_context():
+        add_extra_vocabulary(max(FIXTURE_SIZES) * VOCABULARY_PER_SIZE)
+        user_ids = {size: create_fixture_user(size) for size in FIXTURE_SIZES}
+        category_id = LessonCategory.query.order_by(LessonCategory.order).first().id
+
+    results = {size: measure(user_ids[size], category_id) for size in FIXTURE_SIZES}
+
+    failures = []
+    print(f"{'route':<20}{'budget':>8}" + "".join(f"{f'n={size}':>8}" for size in FIXTURE_SIZES))
+    for endpoint, _, _ in ROUTES:
+        budget = metrics.QUERY_BUDGETS.get(endpoint, metrics.DEFAULT_QUERY_BUDGET)
+        counts = [results[size][endpoint] for size in FIXTURE_SIZES]
+        print(f"{endpoint:<20}{budget:>8}" + "".join(f"{count:>8}" for count in counts))
+
+        if max(counts) > budget:
+            failures.append(f"{endpoint} ran {max(counts)} queries, budget is {budget}")
+        if len(set(counts)) > 1:
+            failures.append(f"{endpoint} query count grows with data volume: {counts}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return not failures
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
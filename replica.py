@@ -0,0 +1,68 @@
+import os
+import time
+from functools import wraps
+
+from flask import g, has_app_context, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+import metrics
+
+REPLICA_BIND = 'replica'
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', 10))
+LAST_WRITE_KEY = '_last_write_at'
+# The session store's own rows say nothing about what the user will read next.
+SESSION_TABLE = 'server_sessions'
+
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # Flushes, and anything read after one in the same transaction, must
+        # see the primary; everything else in a read-only view goes to the
+        # replica.
+        if (bind is None and not self._flushing and not self.info.get('wrote')
+                and has_app_context() and g.get('read_replica')):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _record_flush(db_session, flush_context):
+    objects = [*db_session.new, *db_session.dirty, *db_session.deleted]
+    if any(getattr(obj, '__tablename__', None) != SESSION_TABLE for obj in objects):
+        db_session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _record_commit(db_session):
+    # Stamping the Flask session makes the session store write it back, so
+    # only do it when there is a replica whose lag it has to cover.
+    if (db_session.info.pop('wrote', False) and has_request_context()
+            and REPLICA_BIND in db_session._db.engines):
+        session[LAST_WRITE_KEY] = time.time()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _record_rollback(db_session):
+    db_session.info.pop('wrote', None)
+
+
+def wrote_recently():
+    return time.time() - session.get(LAST_WRITE_KEY, 0) < READ_YOUR_WRITES_SECONDS
+
+
+def read_replica(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        from app import db
+        if REPLICA_BIND in db.engines:
+            # Replication lag would hide the user's own changes for a moment
+            # after they commit, so those requests stay on the primary.
+            g.read_replica = not wrote_recently()
+            metrics.registry.increment('lango_read_routing_total',
+                                       {'target': REPLICA_BIND if g.read_replica else 'primary'})
+        return f(*args, **kwargs)
+    return decorated_function
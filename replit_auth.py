@@ -1,5 +1,6 @@
 import jwt
 import os
+import time
 import uuid
 from functools import wraps
 from urllib.parse import urlencode
@@ -17,19 +18,47 @@ from sqlalchemy.exc import NoResultFound
 from werkzeug.local import LocalProxy
 
 from app import app, db
+from cache import TTLCache
 from models import OAuth, User
 
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 30))
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 4096))
+
+token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
 login_manager = LoginManager(app)
 
 
+def _track_auth_time(started):
+    g.auth_seconds = g.get('auth_seconds', 0) + (time.perf_counter() - started)
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    started = time.perf_counter()
+    try:
+        return db.session.get(User, user_id)
+    finally:
+        _track_auth_time(started)
+
+
+def invalidate_tokens(user_id):
+    token_cache.delete_matching(lambda key: key[0] == user_id)
 
 
 class UserSessionStorage(BaseStorage):
 
+    def cache_key(self, blueprint):
+        return (current_user.get_id(), g.browser_session_key, blueprint.name)
+
     def get(self, blueprint):
+        started = time.perf_counter()
+        key = self.cache_key(blueprint)
+        cached = token_cache.get(key)
+        if cached is not None:
+            _track_auth_time(started)
+            return dict(cached[0]) if cached[0] else cached[0]
+
         try:
             token = db.session.query(OAuth).filter_by(
                 user_id=current_user.get_id(),
@@ -38,9 +67,16 @@ class UserSessionStorage(BaseStorage):
             ).one().token
         except NoResultFound:
             token = None
+        # A refresh in another worker replaces the row, which this process
+        # can't hear about, so a token is only cached while it is certain to
+        # outlive the cache entry; near expiry every request reads the row.
+        if token is None or token.get('expires_at', 0) - time.time() > AUTH_CACHE_TTL:
+            token_cache.set(key, (token,))
+        _track_auth_time(started)
         return token
 
     def set(self, blueprint, token):
+        token_cache.delete(self.cache_key(blueprint))
         db.session.query(OAuth).filter_by(
             user_id=current_user.get_id(),
             browser_session_key=g.browser_session_key,
@@ -55,6 +91,7 @@ class UserSessionStorage(BaseStorage):
         db.session.commit()
 
     def delete(self, blueprint):
+        token_cache.delete(self.cache_key(blueprint))
         db.session.query(OAuth).filter_by(
             user_id=current_user.get_id(),
             browser_session_key=g.browser_session_key,
@@ -98,12 +135,20 @@ def make_replit_blueprint():
 
     @replit_bp.before_app_request
     def set_applocal_session():
+        # Static assets never need a session, so don't mint a cookie for them.
+        if request.endpoint == 'static':
+            return
         if '_browser_session_key' not in session:
             session['_browser_session_key'] = uuid.uuid4().hex
-        session.modified = True
         g.browser_session_key = session['_browser_session_key']
         g.flask_dance_replit = replit_bp.session
 
+    @replit_bp.after_app_request
+    def report_auth_time(response):
+        if 'auth_seconds' in g:
+            response.headers.add('Server-Timing', f"auth;dur={g.auth_seconds * 1000:.2f}")
+        return response
+
     @replit_bp.route("/logout")
     def logout():
         del replit_bp.token
@@ -136,6 +181,7 @@ def save_user(user_claims):
     user.profile_image_url = user_claims.get('profile_image_url')
     db.session.add(user)
     db.session.commit()
+    invalidate_tokens(user.id)
     return user
 
 
@@ -144,6 +190,8 @@ def logged_in(blueprint, token):
     user_claims = jwt.decode(token['id_token'],
                              options={"verify_signature": False})
     user = save_user(user_claims)
+    if hasattr(app.session_interface, 'regenerate'):
+        app.session_interface.regenerate(session)
     login_user(user)
     blueprint.token = token
     next_url = session.pop("next_url", None)
@@ -163,7 +211,8 @@ def require_login(f):
             session["next_url"] = get_next_navigation_url(request)
             return redirect(url_for('replit_auth.login'))
 
-        expires_in = replit.token.get('expires_in', 0) if replit.token else 0
+        token = replit.token
+        expires_in = token.get('expires_in', 0) if token else 0
         if expires_in < 0:
             refresh_token_url = issuer_url + "/token"
             try:
@@ -1,23 +1,43 @@
+import hashlib
+import os
 from datetime import datetime, timedelta
-from flask import render_template, redirect, url_for, request, flash, session
+from flask import render_template, redirect, url_for, request, flash, session, jsonify, abort, stream_with_context
 from flask_login import current_user
+from sqlalchemy import case, event, exists, func, select
+from sqlalchemy.orm import joinedload
 
 from app import app, db
+from cache import TTLCache
 from models import (User, LessonCategory, Vocabulary, Verb, UserProgress, 
-                   ScheduledLesson, ChatSession, ChatMessage, VocabularyReview)
+                   ScheduledLesson, ChatSession, ChatMessage, ChatSessionStats, VocabularyReview, ContentPack)
 from replit_auth import require_login, make_replit_blueprint
+from replica import read_replica
 from seed_data import seed_lesson_content
+import activity
+import availability_service
 import calendar_service
+import calendar_outbox
+import chat_archive
 import gemini_service
+import search_index
+import study_export
+
+PROGRESS_CACHE_TTL = int(os.environ.get('PROGRESS_CACHE_TTL', 300))
+PROGRESS_CACHE_SIZE = int(os.environ.get('PROGRESS_CACHE_SIZE', 4096))
+
+progress_data_cache = TTLCache(maxsize=PROGRESS_CACHE_SIZE, ttl=PROGRESS_CACHE_TTL)
 
 app.register_blueprint(make_replit_blueprint(), url_prefix="/auth")
 
 seed_lesson_content()
+if os.environ.get('LANGO_PRELOAD') != '1':
+    calendar_outbox.start_dispatcher()
 
 
 @app.before_request
 def make_session_permanent():
-    session.permanent = True
+    if request.endpoint != 'static' and not session.permanent:
+        session.permanent = True
 
 
 @app.route('/')
@@ -59,24 +79,22 @@ def onboarding():
             
             first_category = LessonCategory.query.order_by(LessonCategory.order).first()
             if first_category and current_user.calendar_connected:
-                slot = calendar_service.find_available_slot(current_user.lesson_duration)
+                slot = availability_service.find_user_slot(current_user)
                 if slot:
-                    event_id = calendar_service.create_calendar_event(
+                    lesson = ScheduledLesson(
+                        user_id=current_user.id,
+                        category_id=first_category.id,
+                        scheduled_time=slot,
+                        duration_minutes=current_user.lesson_duration
+                    )
+                    db.session.add(lesson)
+                    calendar_outbox.enqueue_create(
+                        lesson,
                         f"Lango Spanish Lesson: {first_category.name}",
-                        slot,
-                        current_user.lesson_duration,
                         f"Time to learn Spanish! Category: {first_category.name}"
                     )
-                    if event_id:
-                        lesson = ScheduledLesson(
-                            user_id=current_user.id,
-                            category_id=first_category.id,
-                            scheduled_time=slot,
-                            duration_minutes=current_user.lesson_duration,
-                            calendar_event_id=event_id
-                        )
-                        db.session.add(lesson)
-                        db.session.commit()
+                    db.session.commit()
+                    calendar_outbox.notify()
             
             return redirect(url_for('dashboard'))
     
@@ -86,6 +104,7 @@ def onboarding():
 
 @app.route('/dashboard')
 @require_login
+@read_replica
 def dashboard():
     if not current_user.onboarding_complete:
         return redirect(url_for('onboarding'))
@@ -96,18 +115,21 @@ def dashboard():
     for p in current_user.progress:
         progress_dict[p.category_id] = p
     
-    upcoming_lessons = ScheduledLesson.query.filter_by(
+    upcoming_lessons = ScheduledLesson.query.options(
+        joinedload(ScheduledLesson.category)
+    ).filter_by(
         user_id=current_user.id,
         completed=False
     ).filter(
         ScheduledLesson.scheduled_time >= datetime.now()
     ).order_by(ScheduledLesson.scheduled_time).limit(3).all()
     
+    vocab_counts = vocabulary_counts_by_category()
     total_vocab = 0
     completed_lessons = 0
     for p in current_user.progress:
         if p.vocabulary_completed:
-            total_vocab += Vocabulary.query.filter_by(category_id=p.category_id).count()
+            total_vocab += vocab_counts.get(p.category_id, 0)
         if p.conversation_completed:
             completed_lessons += 1
     
@@ -122,21 +144,26 @@ def dashboard():
                           streak=streak)
 
 
+def vocabulary_counts_by_category():
+    rows = db.session.query(Vocabulary.category_id, func.count(Vocabulary.id)).group_by(Vocabulary.category_id)
+    return {category_id: count for category_id, count in rows}
+
+
 def calculate_streak(user_id):
-    sessions = ChatSession.query.filter_by(user_id=user_id).filter(
-        ChatSession.ended_at != None
-    ).order_by(ChatSession.ended_at.desc()).all()
+    ended_times = [row.ended_at for row in db.session.query(ChatSession.ended_at).filter(
+        ChatSession.user_id == user_id,
+        ChatSession.ended_at != None,
+        ChatSession.ended_at >= datetime.now() - timedelta(days=31)
+    )]
     
-    if not sessions:
+    if not ended_times:
         return 0
     
+    return streak_from_dates({ended_at.date() for ended_at in ended_times}, datetime.now().date())
+
+
+def streak_from_dates(dates_with_activity, current_date):
     streak = 0
-    current_date = datetime.now().date()
-    
-    dates_with_activity = set()
-    for s in sessions:
-        if s.ended_at:
-            dates_with_activity.add(s.ended_at.date())
     
     for i in range(30):
         check_date = current_date - timedelta(days=i)
@@ -379,6 +406,8 @@ def complete_conversation(category_id):
             current_user.difficulty_level = new_difficulty
             difficulty_change = change_type
         
+        activity.record_activity(current_user.id, conversations=1)
+        chat_archive.record_session_stats(chat_session)
         db.session.commit()
     
     progress = UserProgress.query.filter_by(
@@ -418,9 +447,12 @@ def complete_conversation(category_id):
 
 @app.route('/schedule')
 @require_login
+@read_replica
 def schedule():
     categories = LessonCategory.query.order_by(LessonCategory.order).all()
-    scheduled_lessons = ScheduledLesson.query.filter_by(
+    scheduled_lessons = ScheduledLesson.query.options(
+        joinedload(ScheduledLesson.category)
+    ).filter_by(
         user_id=current_user.id
     ).order_by(ScheduledLesson.scheduled_time).all()
     
@@ -439,9 +471,10 @@ def add_schedule():
     schedule_type = request.form.get('schedule_type')
     
     category = LessonCategory.query.get_or_404(category_id)
+    calendar_connected = calendar_service.is_calendar_connected()
     
     if schedule_type == 'auto':
-        slot = calendar_service.find_available_slot(current_user.lesson_duration)
+        slot = availability_service.find_user_slot(current_user, include_calendar=calendar_connected)
         if not slot:
             flash('Could not find an available time slot. Please try manual scheduling.', 'error')
             return redirect(url_for('schedule'))
@@ -454,29 +487,78 @@ def add_schedule():
             flash('Invalid date/time format.', 'error')
             return redirect(url_for('schedule'))
     
-    event_id = None
-    if calendar_service.is_calendar_connected():
-        event_id = calendar_service.create_calendar_event(
-            f"Lango Spanish Lesson: {category.name}",
-            slot,
-            current_user.lesson_duration,
-            f"Time to learn Spanish! Category: {category.name}"
-        )
-    
     lesson = ScheduledLesson(
         user_id=current_user.id,
         category_id=category_id,
         scheduled_time=slot,
-        duration_minutes=current_user.lesson_duration,
-        calendar_event_id=event_id
+        duration_minutes=current_user.lesson_duration
     )
     db.session.add(lesson)
+    if calendar_connected:
+        calendar_outbox.enqueue_create(
+            lesson,
+            f"Lango Spanish Lesson: {category.name}",
+            f"Time to learn Spanish! Category: {category.name}"
+        )
     db.session.commit()
+    calendar_outbox.notify()
     
     flash('Lesson scheduled successfully!', 'success')
     return redirect(url_for('schedule'))
 
 
+@app.route('/schedule/course', methods=['POST'])
+@require_login
+def schedule_course():
+    categories = LessonCategory.query.order_by(LessonCategory.order).all()
+    
+    completed_ids = {p.category_id for p in current_user.progress if p.conversation_completed}
+    scheduled_ids = {row.category_id for row in db.session.query(ScheduledLesson.category_id).filter_by(
+        user_id=current_user.id,
+        completed=False
+    )}
+    remaining = [c for c in categories if c.id not in completed_ids and c.id not in scheduled_ids]
+    
+    if not remaining:
+        flash('Every remaining lesson is already scheduled.', 'info')
+        return redirect(url_for('schedule'))
+    
+    calendar_connected = calendar_service.is_calendar_connected()
+    
+    slots = availability_service.find_user_slots(
+        current_user,
+        len(remaining),
+        days=max(7, len(remaining) * 2),
+        include_calendar=calendar_connected,
+        one_per_day=True
+    )
+    if len(slots) < len(remaining):
+        flash('Could not find enough available time slots. Please try manual scheduling.', 'error')
+        return redirect(url_for('schedule'))
+    
+    lessons = [ScheduledLesson(
+        user_id=current_user.id,
+        category_id=category.id,
+        scheduled_time=slot,
+        duration_minutes=current_user.lesson_duration
+    ) for category, slot in zip(remaining, slots)]
+    db.session.add_all(lessons)
+    db.session.flush()
+    
+    if calendar_connected:
+        for category, lesson in zip(remaining, lessons):
+            calendar_outbox.enqueue_create(
+                lesson,
+                f"Lango Spanish Lesson: {category.name}",
+                f"Time to learn Spanish! Category: {category.name}"
+            )
+    db.session.commit()
+    calendar_outbox.notify()
+    
+    flash(f'Scheduled {len(remaining)} lessons!', 'success')
+    return redirect(url_for('schedule'))
+
+
 @app.route('/schedule/reschedule/<int:lesson_id>', methods=['GET', 'POST'])
 @require_login
 def reschedule_lesson(lesson_id):
@@ -493,7 +575,12 @@ def reschedule_lesson(lesson_id):
         schedule_type = request.form.get('schedule_type')
         
         if schedule_type == 'auto':
-            new_slot = calendar_service.find_available_slot(lesson.duration_minutes)
+            new_slot = availability_service.find_user_slot(
+                current_user,
+                lesson.duration_minutes,
+                include_calendar=calendar_service.is_calendar_connected(),
+                exclude_lesson_id=lesson.id
+            )
             if not new_slot:
                 flash('Could not find an available time slot. Please try manual scheduling.', 'error')
                 return redirect(url_for('reschedule_lesson', lesson_id=lesson_id))
@@ -509,14 +596,10 @@ def reschedule_lesson(lesson_id):
         old_time = lesson.scheduled_time
         lesson.scheduled_time = new_slot
         
-        if lesson.calendar_event_id and calendar_service.is_calendar_connected():
-            calendar_service.update_calendar_event(
-                lesson.calendar_event_id,
-                start_time=new_slot,
-                duration_minutes=lesson.duration_minutes
-            )
+        calendar_outbox.enqueue_update(lesson)
         
         db.session.commit()
+        calendar_outbox.notify()
         flash(f'Lesson rescheduled from {old_time.strftime("%b %d, %I:%M %p")} to {new_slot.strftime("%b %d, %I:%M %p")}!', 'success')
         return redirect(url_for('schedule'))
     
@@ -534,11 +617,11 @@ def cancel_lesson(lesson_id):
         user_id=current_user.id
     ).first_or_404()
     
-    if lesson.calendar_event_id and calendar_service.is_calendar_connected():
-        calendar_service.delete_calendar_event(lesson.calendar_event_id)
+    calendar_outbox.enqueue_delete(lesson)
     
     db.session.delete(lesson)
     db.session.commit()
+    calendar_outbox.notify()
     
     flash('Lesson cancelled successfully.', 'info')
     return redirect(url_for('schedule'))
@@ -546,6 +629,7 @@ def cancel_lesson(lesson_id):
 
 @app.route('/progress')
 @require_login
+@read_replica
 def progress():
     categories = LessonCategory.query.order_by(LessonCategory.order).all()
     user_progress = UserProgress.query.filter_by(user_id=current_user.id).all()
@@ -554,11 +638,12 @@ def progress():
     for p in user_progress:
         progress_dict[p.category_id] = p
     
-    total_vocab = sum([Vocabulary.query.filter_by(category_id=c.id).count() for c in categories])
+    vocab_counts = vocabulary_counts_by_category()
+    total_vocab = sum([vocab_counts.get(c.id, 0) for c in categories])
     learned_vocab = 0
     for p in user_progress:
         if p.vocabulary_completed:
-            learned_vocab += Vocabulary.query.filter_by(category_id=p.category_id).count()
+            learned_vocab += vocab_counts.get(p.category_id, 0)
     
     completed_lessons = sum([1 for p in user_progress if p.conversation_completed])
     total_lessons = len(categories)
@@ -568,36 +653,26 @@ def progress():
     chat_sessions = ChatSession.query.filter_by(user_id=current_user.id).all()
     conversation_count = len([s for s in chat_sessions if s.ended_at])
     
-    all_reviews = VocabularyReview.query.filter_by(user_id=current_user.id).all()
-    mastery_stats = {
-        'new': 0,
-        'learning': 0,
-        'reviewing': 0,
-        'mastered': 0
-    }
-    
-    reviewed_vocab_ids = set()
-    for review in all_reviews:
-        reviewed_vocab_ids.add(review.vocabulary_id)
-        if review.repetitions == 0:
-            mastery_stats['new'] += 1
-        elif review.repetitions < 3:
-            mastery_stats['learning'] += 1
-        elif review.repetitions < 5:
-            mastery_stats['reviewing'] += 1
-        else:
-            mastery_stats['mastered'] += 1
-    
-    total_messages = 0
-    user_messages = 0
-    ai_messages = 0
     completed_sessions = [s for s in chat_sessions if s.ended_at is not None]
     
-    for session in completed_sessions:
-        messages = ChatMessage.query.filter_by(session_id=session.id).all()
-        total_messages += len(messages)
-        user_messages += len([m for m in messages if m.role == 'user'])
-        ai_messages += len([m for m in messages if m.role == 'assistant'])
+    # Ended sessions from before the counters existed have no stats row until
+    # `chat_archive.py --backfill-stats` runs, so their messages are counted.
+    summarized = select(ChatSessionStats.message_count, ChatSessionStats.user_message_count).where(
+        ChatSessionStats.user_id == current_user.id
+    ).subquery()
+    unsummarized = select(ChatMessage.id, ChatMessage.role).join(
+        ChatSession, ChatMessage.session_id == ChatSession.id
+    ).where(
+        ChatSession.user_id == current_user.id,
+        ChatSession.ended_at != None,
+        ~exists().where(ChatSessionStats.session_id == ChatSession.id)
+    ).subquery()
+    total_messages, user_messages = db.session.query(
+        select(func.coalesce(func.sum(summarized.c.message_count), 0)).scalar_subquery()
+        + select(func.count(unsummarized.c.id)).scalar_subquery(),
+        select(func.coalesce(func.sum(summarized.c.user_message_count), 0)).scalar_subquery()
+        + select(func.count(case((unsummarized.c.role == 'user', 1)))).scalar_subquery()
+    ).one()
     
     if completed_sessions and total_messages > 0:
         avg_messages_per_session = round(total_messages / len(completed_sessions), 1)
@@ -615,44 +690,117 @@ def progress():
                 pass
     total_practice_minutes = round(total_practice_minutes)
     
+    return render_template('progress.html',
+                          categories=categories,
+                          progress_dict=progress_dict,
+                          total_vocab=total_vocab,
+                          learned_vocab=learned_vocab,
+                          completed_lessons=completed_lessons,
+                          total_lessons=total_lessons,
+                          streak=streak,
+                          conversation_count=conversation_count,
+                          total_messages=total_messages,
+                          user_messages=user_messages,
+                          avg_messages_per_session=avg_messages_per_session,
+                          total_practice_minutes=total_practice_minutes)
+
+
+@app.route('/progress/data')
+@require_login
+@read_replica
+def progress_data():
+    etag = progress_etag(current_user.id)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        cached = progress_data_cache.get(current_user.id)
+        if cached is None or cached[0] != etag:
+            cached = (etag, progress_chart_data(current_user.id))
+            progress_data_cache.set(current_user.id, cached)
+        response = jsonify(cached[1])
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def progress_etag(user_id):
+    # Rating a review moves last_reviewed and finishing a conversation sets
+    # ended_at, so these aggregates change whenever the chart data would.
+    # Every content import records a ContentPack row, so its latest id covers
+    # the category totals without counting the whole catalog.
+    fingerprint = db.session.query(
+        select(func.count(VocabularyReview.id)).where(VocabularyReview.user_id == user_id).scalar_subquery(),
+        select(func.max(VocabularyReview.last_reviewed)).where(VocabularyReview.user_id == user_id).scalar_subquery(),
+        select(func.count(ChatSession.id)).where(ChatSession.user_id == user_id).scalar_subquery(),
+        select(func.max(ChatSession.ended_at)).where(ChatSession.user_id == user_id).scalar_subquery(),
+        select(func.max(ContentPack.id)).scalar_subquery(),
+    ).one()
+    fingerprint = (user_id, datetime.now().date(), *fingerprint)
+    return hashlib.sha1(repr(fingerprint).encode()).hexdigest()
+
+
+@event.listens_for(VocabularyReview, 'after_insert')
+@event.listens_for(VocabularyReview, 'after_update')
+@event.listens_for(VocabularyReview, 'after_delete')
+@event.listens_for(ChatSession, 'after_insert')
+@event.listens_for(ChatSession, 'after_update')
+@event.listens_for(ChatSession, 'after_delete')
+def _progress_changed(mapper, connection, target):
+    progress_data_cache.delete(target.user_id)
+
+
+def progress_chart_data(user_id):
+    categories = LessonCategory.query.order_by(LessonCategory.order).all()
+    all_reviews = VocabularyReview.query.filter_by(user_id=user_id).all()
+    mastery_stats = {
+        'new': 0,
+        'learning': 0,
+        'reviewing': 0,
+        'mastered': 0
+    }
+    
+    for review in all_reviews:
+        if review.repetitions == 0:
+            mastery_stats['new'] += 1
+        elif review.repetitions < 3:
+            mastery_stats['learning'] += 1
+        elif review.repetitions < 5:
+            mastery_stats['reviewing'] += 1
+        else:
+            mastery_stats['mastered'] += 1
+    
+    today = datetime.now().date()
+    days = activity.activity_by_day(user_id, today=today)
+    heatmap = [
+        {'date': day.isoformat(), 'reviews': reviews, 'conversations': conversations}
+        for day, (reviews, conversations) in sorted(days.items())
+    ]
+    
     activity_data = []
     for i in range(6, -1, -1):
-        day = datetime.now().date() - timedelta(days=i)
-        day_start = datetime.combine(day, datetime.min.time())
-        day_end = datetime.combine(day, datetime.max.time())
-        
-        vocab_count = VocabularyReview.query.filter(
-            VocabularyReview.user_id == current_user.id,
-            VocabularyReview.last_reviewed != None,
-            VocabularyReview.last_reviewed >= day_start,
-            VocabularyReview.last_reviewed <= day_end
-        ).count()
-        
-        session_count = ChatSession.query.filter(
-            ChatSession.user_id == current_user.id,
-            ChatSession.ended_at != None,
-            ChatSession.ended_at >= day_start,
-            ChatSession.ended_at <= day_end
-        ).count()
-        
+        day = today - timedelta(days=i)
+        reviews, conversations = days.get(day, (0, 0))
         activity_data.append({
             'day': day.strftime('%a'),
             'date': day.strftime('%m/%d'),
-            'reviews': vocab_count,
-            'conversations': session_count
+            'reviews': reviews,
+            'conversations': conversations
         })
     
     category_mastery = []
-    all_vocab_ids = [v.id for v in Vocabulary.query.all()]
+    vocab_ids_by_category = {}
+    for vocab_id, vocab_category_id in db.session.query(Vocabulary.id, Vocabulary.category_id):
+        vocab_ids_by_category.setdefault(vocab_category_id, []).append(vocab_id)
     user_reviews_dict = {r.vocabulary_id: r for r in all_reviews}
     
     for category in categories:
-        category_vocab = Vocabulary.query.filter_by(category_id=category.id).all()
+        category_vocab_ids = vocab_ids_by_category.get(category.id, [])
         mastered_in_category = 0
-        total_in_category = len(category_vocab)
+        total_in_category = len(category_vocab_ids)
         
-        for vocab in category_vocab:
-            review = user_reviews_dict.get(vocab.id)
+        for vocab_id in category_vocab_ids:
+            review = user_reviews_dict.get(vocab_id)
             if review and review.repetitions >= 5:
                 mastered_in_category += 1
         
@@ -668,25 +816,51 @@ def progress():
             'percent': mastery_percent
         })
     
-    has_review_data = sum(mastery_stats.values()) > 0
-    
-    return render_template('progress.html',
-                          categories=categories,
-                          progress_dict=progress_dict,
-                          total_vocab=total_vocab,
-                          learned_vocab=learned_vocab,
-                          completed_lessons=completed_lessons,
-                          total_lessons=total_lessons,
-                          streak=streak,
-                          conversation_count=conversation_count,
-                          mastery_stats=mastery_stats,
-                          has_review_data=has_review_data,
-                          total_messages=total_messages,
-                          user_messages=user_messages,
-                          avg_messages_per_session=avg_messages_per_session,
-                          total_practice_minutes=total_practice_minutes,
-                          activity_data=activity_data,
-                          category_mastery=category_mastery)
+    return {
+        'activity_data': activity_data,
+        'heatmap': heatmap,
+        'mastery_stats': mastery_stats,
+        'has_review_data': sum(mastery_stats.values()) > 0,
+        'category_mastery': category_mastery
+    }
+
+
+@app.route('/search')
+@require_login
+@read_replica
+def search_vocabulary():
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', 20, type=int)
+    results = search_index.search(query, limit) if query else []
+    return jsonify({'query': query, 'results': results})
+
+
+@app.route('/export/<dataset>.<fmt>')
+@require_login
+@read_replica
+def export_data(dataset, fmt):
+    if dataset not in study_export.DATASETS or fmt not in study_export.FORMATS:
+        abort(404)
+    return export_response(study_export.export(current_user.id, dataset, fmt),
+                           study_export.FORMATS[fmt], f"lango-{dataset}-{datetime.now():%Y-%m-%d}.{fmt}")
+
+
+@app.route('/export/anki.txt')
+@require_login
+@read_replica
+def export_anki():
+    return export_response(study_export.anki_deck(current_user.id), 'text/plain',
+                           f"lango-anki-{datetime.now():%Y-%m-%d}.txt")
+
+
+def export_response(chunks, mimetype, filename):
+    # Rows are produced while the body is sent, so memory stays flat no
+    # matter how long the user's history is.
+    response = app.response_class(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
 
 
 def calculate_sm2(quality, repetitions, ease_factor, interval):
@@ -711,10 +885,13 @@ def calculate_sm2(quality, repetitions, ease_factor, interval):
 
 @app.route('/review')
 @require_login
+@read_replica
 def review():
     now = datetime.now()
     
-    due_reviews = VocabularyReview.query.filter(
+    due_reviews = VocabularyReview.query.options(
+        joinedload(VocabularyReview.vocabulary).joinedload(Vocabulary.category)
+    ).filter(
         VocabularyReview.user_id == current_user.id,
         VocabularyReview.next_review_date <= now
     ).order_by(VocabularyReview.next_review_date).all()
@@ -768,6 +945,7 @@ def rate_review(review_id):
     review.interval_days = interval
     review.last_reviewed = datetime.now()
     review.next_review_date = datetime.now() + timedelta(days=interval)
+    activity.record_activity(current_user.id, reviews=1)
     
     db.session.commit()
     
@@ -0,0 +1,28 @@
+import logging
+
+from sqlalchemy import inspect, text
+
+from models import ScheduledLesson
+
+# db.create_all() only creates missing tables, so columns and indexes added
+# to a table that already exists in a deployed database are created here.
+COLUMNS = [ScheduledLesson.__table__.c.calendar_etag]
+INDEXES = [
+    index for index in ScheduledLesson.__table__.indexes if index.name == 'ix_scheduled_lessons_user_time'
+]
+
+
+def upgrade(engine):
+    inspector = inspect(engine)
+    for column in COLUMNS:
+        existing = {c['name'] for c in inspector.get_columns(column.table.name)}
+        if column.name in existing:
+            continue
+        # New columns are nullable, so adding one never rewrites the table.
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"ALTER TABLE {column.table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+            ))
+        logging.info(f"Added column {column.table.name}.{column.name}")
+    for index in INDEXES:
+        index.create(engine, checkfirst=True)
@@ -0,0 +1,311 @@
+import argparse
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter
+
+from sqlalchemy import func, select, text
+
+from app import app, db
+from models import LessonCategory, Vocabulary, Verb, ContentPack
+
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+SEARCH_SIMILARITY_THRESHOLD = float(os.environ.get('SEARCH_SIMILARITY_THRESHOLD', 0.3))
+SEARCH_INDEX_CHECK_SECONDS = int(os.environ.get('SEARCH_INDEX_CHECK_SECONDS', 30))
+SEARCH_MAX_RESULTS = 50
+
+CONJUGATIONS = [('yo', 'yo'), ('tu', 'tú'), ('el_ella', 'él/ella'), ('nosotros', 'nosotros'),
+                ('vosotros', 'vosotros'), ('ellos', 'ellos')]
+NON_WORD = re.compile(r'[^\w]+')
+# Phrases are also indexed word by word, but not their articles and particles.
+MIN_WORD_LENGTH = 3
+# Leading articles ("el desayuno", "to eat") are in so many entries that their
+# trigrams would dominate every lookup, and nobody searches by them.
+ARTICLES = {'el', 'la', 'los', 'las', 'lo', 'un', 'una', 'unos', 'unas', 'the', 'a', 'an', 'to'}
+
+
+def fold(value):
+    # "¿Cómo estás?" -> "como estas": accents, case and punctuation never
+    # affect a match, in either language.
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return NON_WORD.sub(' ', stripped.casefold()).replace('_', ' ').strip()
+
+
+def strip_article(folded):
+    article, _, rest = folded.partition(' ')
+    return rest if rest and article in ARTICLES else folded
+
+
+def trigrams(folded):
+    # Padded like pg_trgm so word starts and ends count, minus its "  x"
+    # first-letter gram: that one is shared by a twentieth of the catalog and
+    # would make every lookup walk huge postings lists.
+    grams = set()
+    for word in folded.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared) if shared else 0.0
+
+
+class TrigramIndex:
+
+    def __init__(self, fingerprint=None):
+        self.fingerprint = fingerprint
+        # Entries are vocabulary words and verbs; terms are the strings that
+        # can match one (each language, each conjugation, each phrase word).
+        self.entries = []
+        self.term_text = []
+        self.term_entry = array('I')
+        self.term_size = array('H')
+        self.term_form = []
+        self.postings = {}
+
+    def add_entry(self, entry, forms):
+        entry_id = len(self.entries)
+        self.entries.append(entry)
+        seen = set()
+        for form, label in forms:
+            folded = strip_article(fold(form))
+            terms = [folded] + [word for word in folded.split() if len(word) >= MIN_WORD_LENGTH]
+            for term in terms:
+                if not term or term in seen:
+                    continue
+                seen.add(term)
+                term_id = len(self.term_text)
+                self.term_text.append(term)
+                self.term_entry.append(entry_id)
+                self.term_form.append(label)
+                grams = trigrams(term)
+                self.term_size.append(len(grams))
+                for gram in grams:
+                    self.postings.setdefault(gram, []).append(term_id)
+
+    def freeze(self):
+        self.postings = {gram: array('I', term_ids) for gram, term_ids in self.postings.items()}
+
+    def search(self, query, limit=20, threshold=SEARCH_SIMILARITY_THRESHOLD):
+        query_grams = trigrams(strip_article(fold(query)))
+        if not query_grams:
+            return []
+
+        # Overlap counts come straight from the postings (Counter.update runs
+        # in C); a term with fewer than ceil(threshold * n) of the query's n
+        # trigrams can never reach the threshold and is skipped unscored.
+        counts = Counter()
+        for gram in query_grams:
+            postings = self.postings.get(gram)
+            if postings is not None:
+                counts.update(postings)
+        size = len(query_grams)
+        needed = math.ceil(threshold * size)
+
+        best = {}
+        for term_id, shared in counts.items():
+            if shared < needed:
+                continue
+            score = shared / (size + self.term_size[term_id] - shared)
+            if score < threshold:
+                continue
+            entry_id = self.term_entry[term_id]
+            if entry_id not in best or score > best[entry_id][0]:
+                best[entry_id] = (score, self.term_form[term_id])
+
+        results = sorted(best.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+        return [
+            {**self.entries[entry_id], 'matched': form, 'score': round(score, 3)}
+            for entry_id, (score, form) in results
+        ]
+
+
+def _entry(kind, id, spanish, english, category):
+    return {'type': kind, 'id': id, 'spanish': spanish, 'english': english, 'category': category}
+
+
+def build_index(fingerprint=None):
+    started = time.perf_counter()
+    index = TrigramIndex(fingerprint)
+    categories = dict(db.session.query(LessonCategory.id, LessonCategory.name))
+
+    vocabulary = db.session.query(
+        Vocabulary.id, Vocabulary.spanish_word, Vocabulary.english_word, Vocabulary.category_id
+    ).order_by(Vocabulary.id).execution_options(yield_per=5000)
+    for id, spanish, english, category_id in vocabulary:
+        index.add_entry(_entry('vocabulary', id, spanish, english, categories.get(category_id)),
+                        [(spanish, spanish), (english, english)])
+
+    columns = [getattr(Verb, column) for column, _ in CONJUGATIONS]
+    verbs = db.session.query(
+        Verb.id, Verb.infinitive, Verb.english_meaning, Verb.category_id, *columns
+    ).order_by(Verb.id).execution_options(yield_per=5000)
+    for id, infinitive, english, category_id, *forms in verbs:
+        conjugated = [(form, f"{form} ({pronoun})") for form, (_, pronoun) in zip(forms, CONJUGATIONS) if form]
+        index.add_entry(_entry('verb', id, infinitive, english, categories.get(category_id)),
+                        [(infinitive, infinitive), (english, english), *conjugated])
+
+    index.freeze()
+    logging.info(f"Built search index of {len(index.entries)} entries and {len(index.term_text)} terms "
+                 f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return index
+
+
+def content_fingerprint():
+    # Imports append rows or record a new ContentPack version, so these move
+    # whenever the catalog does.
+    return tuple(db.session.query(
+        select(func.count(Vocabulary.id)).scalar_subquery(),
+        select(func.max(Vocabulary.id)).scalar_subquery(),
+        select(func.count(Verb.id)).scalar_subquery(),
+        select(func.max(Verb.id)).scalar_subquery(),
+        select(func.max(ContentPack.id)).scalar_subquery(),
+    ).one())
+
+
+_index = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index, _index_checked_at
+    current = _index
+    if current is not None and time.monotonic() - _index_checked_at < SEARCH_INDEX_CHECK_SECONDS:
+        return current
+    # One thread checks and rebuilds; the others keep searching the current
+    # index until the new one replaces it, and only wait when there is none.
+    if not _index_lock.acquire(blocking=current is None):
+        return current
+    try:
+        if _index is None or time.monotonic() - _index_checked_at >= SEARCH_INDEX_CHECK_SECONDS:
+            fingerprint = content_fingerprint()
+            if _index is None or _index.fingerprint != fingerprint:
+                _index = build_index(fingerprint)
+            _index_checked_at = time.monotonic()
+        return _index
+    finally:
+        _index_lock.release()
+
+
+POSTGRES_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() is only STABLE; pinning the dictionary lets an immutable
+    # wrapper be used in index expressions. The body mirrors
+    # strip_article(fold(...)) so both backends match the same way.
+    "CREATE OR REPLACE FUNCTION lango_fold(text) RETURNS text LANGUAGE sql IMMUTABLE PARALLEL SAFE "
+    "AS $$ SELECT regexp_replace(btrim(regexp_replace("
+    "lower(public.unaccent('public.unaccent'::regdictionary, $1)), '[^[:alnum:]]+', ' ', 'g')), "
+    f"'^({'|'.join(sorted(ARTICLES))}) ', '') $$",
+    "CREATE INDEX IF NOT EXISTS ix_vocabulary_spanish_trgm ON vocabulary USING gin (lango_fold(spanish_word) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_vocabulary_english_trgm ON vocabulary USING gin (lango_fold(english_word) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_verbs_infinitive_trgm ON verbs USING gin (lango_fold(infinitive) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_verbs_english_trgm ON verbs USING gin (lango_fold(english_meaning) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_verbs_forms_trgm ON verbs USING gin "
+    "(lango_fold(concat_ws(' ', yo, tu, el_ella, nosotros, vosotros, ellos)) gin_trgm_ops)",
+    # Indexes built on an earlier lango_fold body would no longer match it.
+    "REINDEX INDEX ix_vocabulary_spanish_trgm",
+    "REINDEX INDEX ix_vocabulary_english_trgm",
+    "REINDEX INDEX ix_verbs_infinitive_trgm",
+    "REINDEX INDEX ix_verbs_english_trgm",
+    "REINDEX INDEX ix_verbs_forms_trgm",
+]
+
+POSTGRES_SEARCH = text("""
+    SELECT 'vocabulary' AS kind, v.id, v.spanish_word, v.english_word, c.name,
+           NULL AS yo, NULL AS tu, NULL AS el_ella, NULL AS nosotros, NULL AS vosotros, NULL AS ellos,
+           greatest(similarity(lango_fold(v.spanish_word), :q), similarity(lango_fold(v.english_word), :q)) AS score
+    FROM vocabulary v JOIN lesson_categories c ON c.id = v.category_id
+    WHERE lango_fold(v.spanish_word) % :q OR lango_fold(v.english_word) % :q
+    UNION ALL
+    SELECT 'verb', b.id, b.infinitive, b.english_meaning, c.name,
+           b.yo, b.tu, b.el_ella, b.nosotros, b.vosotros, b.ellos,
+           greatest(similarity(lango_fold(b.infinitive), :q), similarity(lango_fold(b.english_meaning), :q),
+                    word_similarity(:q, lango_fold(concat_ws(' ', b.yo, b.tu, b.el_ella, b.nosotros, b.vosotros, b.ellos))))
+    FROM verbs b JOIN lesson_categories c ON c.id = b.category_id
+    WHERE lango_fold(b.infinitive) % :q OR lango_fold(b.english_meaning) % :q
+       OR :q <% lango_fold(concat_ws(' ', b.yo, b.tu, b.el_ella, b.nosotros, b.vosotros, b.ellos))
+    ORDER BY score DESC, id
+    LIMIT :limit
+""")
+
+_postgres_ready = None
+
+
+def postgres_ready():
+    global _postgres_ready
+    if _postgres_ready is None:
+        _postgres_ready = db.session.get_bind().dialect.name == 'postgresql' and bool(db.session.execute(text(
+            "SELECT count(*) = 2 FROM pg_extension WHERE extname IN ('pg_trgm', 'unaccent')"
+        )).scalar() and db.session.execute(text("SELECT to_regprocedure('lango_fold(text)') IS NOT NULL")).scalar())
+    return _postgres_ready
+
+
+def _best_form(query_grams, forms):
+    return max(forms, key=lambda form: similarity(query_grams, trigrams(strip_article(fold(form[0])))))[1]
+
+
+def _postgres_search(query, limit):
+    folded = strip_article(fold(query))
+    if not folded:
+        return []
+    query_grams = trigrams(folded)
+    results = []
+    for kind, id, spanish, english, category, *conjugations, score in db.session.execute(
+        POSTGRES_SEARCH, {'q': folded, 'limit': limit}
+    ):
+        # Report which form matched, as the in-memory index does.
+        forms = [(spanish, spanish), (english, english)] + [
+            (form, f"{form} ({pronoun})") for form, (_, pronoun) in zip(conjugations, CONJUGATIONS) if form
+        ]
+        results.append({**_entry(kind, id, spanish, english, category),
+                        'matched': _best_form(query_grams, forms), 'score': round(score, 3)})
+    return results
+
+
+def uses_postgres():
+    return SEARCH_BACKEND == 'pg_trgm' or (SEARCH_BACKEND == 'auto' and postgres_ready())
+
+
+def warm_up():
+    if not uses_postgres():
+        get_index()
+
+
+def search(query, limit=20):
+    limit = max(1, min(limit, SEARCH_MAX_RESULTS))
+    if uses_postgres():
+        return _postgres_search(query, limit)
+    return get_index().search(query, limit)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vocabulary and verb search")
+    parser.add_argument('--setup-postgres', action='store_true',
+                        help="install pg_trgm/unaccent and create the trigram indexes (PostgreSQL)")
+    parser.add_argument('query', nargs='?')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.setup_postgres:
+            with db.engine.begin() as conn:
+                for statement in POSTGRES_SETUP:
+                    conn.execute(text(statement))
+            print("Trigram search indexes are ready")
+        if args.query:
+            started = time.perf_counter()
+            for result in search(args.query):
+                print(f"{result['score']:.2f}  {result['type']:<10} {result['spanish']} = {result['english']}  "
+                      f"[{result['matched']}]")
+            print(f"{(time.perf_counter() - started) * 1000:.2f}ms")
+        if not (args.setup_postgres or args.query):
+            parser.print_help()
@@ -0,0 +1,139 @@
+import os
+import random
+import secrets
+import time
+from datetime import datetime, timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from app import db
+from models import ServerSession
+
+SESSION_REFRESH_INTERVAL = timedelta(seconds=int(os.environ.get('SESSION_REFRESH_INTERVAL', 3600)))
+SESSION_CLEANUP_PROBABILITY = 0.01
+
+serializer = TaggedJSONSerializer()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, new=False, serialized=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.serialized = serialized
+        self.expires_at = expires_at
+        self.modified = False
+
+
+class DatabaseSessionInterface(SessionInterface):
+
+    def new_session(self):
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def regenerate(self, session):
+        # Called on login so an id planted before authentication (session
+        # fixation) never becomes an authenticated one.
+        if not session.new:
+            table = ServerSession.__table__
+            with db.engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.id == session.sid))
+        session.sid = secrets.token_urlsafe(32)
+        session.new = True
+        session.serialized = None
+        session.modified = True
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return self.new_session()
+
+        table = ServerSession.__table__
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                table.select().where(
+                    table.c.id == sid,
+                    table.c.expires_at > datetime.now()
+                )
+            ).first()
+
+        if row is None:
+            return self.new_session()
+
+        try:
+            data = serializer.loads(row.data)
+        except ValueError:
+            return self.new_session()
+
+        return ServerSideSession(data, sid=sid, serialized=row.data, expires_at=row.expires_at)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        table = ServerSession.__table__
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if not session.new and session.modified:
+                with db.engine.begin() as connection:
+                    connection.execute(table.delete().where(table.c.id == session.sid))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = datetime.now()
+        expires_at = now + app.permanent_session_lifetime
+        serialized = serializer.dumps(dict(session))
+
+        # Writes happen only when the data actually changed or the sliding
+        # expiry has drifted by more than SESSION_REFRESH_INTERVAL.
+        changed = serialized != session.serialized
+        stale = session.expires_at is None or expires_at - session.expires_at >= SESSION_REFRESH_INTERVAL
+        if not changed and not stale:
+            return
+
+        with db.engine.begin() as connection:
+            if session.new:
+                connection.execute(table.insert().values(id=session.sid, data=serialized, expires_at=expires_at))
+            elif changed:
+                connection.execute(table.update().where(table.c.id == session.sid).values(data=serialized, expires_at=expires_at))
+            else:
+                connection.execute(table.update().where(table.c.id == session.sid).values(expires_at=expires_at))
+
+            if random.random() < SESSION_CLEANUP_PROBABILITY:
+                connection.execute(table.delete().where(table.c.expires_at <= now))
+
+        if session.new or stale:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=expires_at if session.permanent else None,
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+class CookieSessionInterface(SecureCookieSessionInterface):
+
+    def save_session(self, app, session, response):
+        # Same coarse refresh for the signed-cookie session: the cookie is
+        # only re-sent when the data changed or the last refresh is older
+        # than SESSION_REFRESH_INTERVAL, instead of on every response.
+        if session and session.permanent:
+            now = int(time.time())
+            if now - session.get('_refreshed_at', 0) >= SESSION_REFRESH_INTERVAL.total_seconds():
+                session['_refreshed_at'] = now
+        super().save_session(app, session, response)
+
+    def should_set_cookie(self, app, session):
+        return session.modified
@@ -0,0 +1,173 @@
+import csv
+import heapq
+import json
+import os
+import zlib
+from datetime import date, datetime
+
+from sqlalchemy import select
+
+from app import db
+from models import (Vocabulary, LessonCategory, VocabularyReview, DailyActivity, ChatSession,
+                    ChatMessage, ChatMessageArchive)
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+EXPORT_CHUNK_BYTES = int(os.environ.get('EXPORT_CHUNK_BYTES', 64 * 1024))
+
+REVIEW_FIELDS = ['spanish', 'english', 'category', 'repetitions', 'ease_factor', 'interval_days',
+                 'last_reviewed', 'next_review_date']
+HISTORY_FIELDS = ['day', 'reviews', 'conversations']
+CONVERSATION_FIELDS = ['session_id', 'category', 'started_at', 'ended_at', 'role', 'content', 'created_at']
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+DATASETS = {
+    'reviews': REVIEW_FIELDS,
+    'history': HISTORY_FIELDS,
+    'conversations': CONVERSATION_FIELDS,
+}
+
+
+def _stream(statement):
+    # yield_per turns on stream_results, which is a server-side cursor on
+    # PostgreSQL, so rows arrive in batches instead of all at once.
+    return db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+
+def _serialize(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def review_rows(user_id):
+    statement = select(
+        Vocabulary.spanish_word, Vocabulary.english_word, LessonCategory.name, VocabularyReview.repetitions,
+        VocabularyReview.ease_factor, VocabularyReview.interval_days, VocabularyReview.last_reviewed,
+        VocabularyReview.next_review_date
+    ).join(Vocabulary, VocabularyReview.vocabulary_id == Vocabulary.id).join(
+        LessonCategory, Vocabulary.category_id == LessonCategory.id
+    ).where(VocabularyReview.user_id == user_id).order_by(VocabularyReview.id)
+    for row in _stream(statement):
+        yield dict(zip(REVIEW_FIELDS, row))
+
+
+def history_rows(user_id):
+    statement = select(DailyActivity.day, DailyActivity.reviews, DailyActivity.conversations).where(
+        DailyActivity.user_id == user_id
+    ).order_by(DailyActivity.day)
+    for row in _stream(statement):
+        yield dict(zip(HISTORY_FIELDS, row))
+
+
+def _live_messages(user_id):
+    statement = select(
+        ChatSession.id, LessonCategory.name, ChatSession.started_at, ChatSession.ended_at,
+        ChatMessage.role, ChatMessage.content, ChatMessage.created_at
+    ).join(ChatSession, ChatMessage.session_id == ChatSession.id).join(
+        LessonCategory, ChatSession.category_id == LessonCategory.id
+    ).where(ChatSession.user_id == user_id).order_by(ChatSession.id, ChatMessage.created_at, ChatMessage.id)
+    for row in _stream(statement):
+        yield tuple(row)
+
+
+def _archived_messages(user_id):
+    statement = select(
+        ChatSession.id, LessonCategory.name, ChatSession.started_at, ChatSession.ended_at,
+        ChatMessageArchive.payload
+    ).join(ChatSession, ChatMessageArchive.session_id == ChatSession.id).join(
+        LessonCategory, ChatSession.category_id == LessonCategory.id
+    ).where(ChatSession.user_id == user_id).order_by(ChatSession.id)
+    # Only one session's archive is decompressed at a time.
+    for session_id, category, started_at, ended_at, payload in _stream(statement):
+        for role, content, created_at in json.loads(zlib.decompress(payload)):
+            yield (session_id, category, started_at, ended_at, role, content, created_at)
+
+
+def conversation_rows(user_id):
+    messages = heapq.merge(_archived_messages(user_id), _live_messages(user_id), key=lambda row: row[0])
+    for row in messages:
+        yield dict(zip(CONVERSATION_FIELDS, row))
+
+
+ROWS = {
+    'reviews': review_rows,
+    'history': history_rows,
+    'conversations': conversation_rows,
+}
+
+
+class _LineBuffer:
+
+    def write(self, line):
+        return line
+
+
+def _chunked(lines):
+    # Rows are small; grouping them keeps per-chunk overhead (and the
+    # compression middleware's flushes) from dominating.
+    pending = []
+    size = 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield ''.join(pending)
+            pending = []
+            size = 0
+    if pending:
+        yield ''.join(pending)
+
+
+def as_csv(fields, rows):
+    writer = csv.writer(_LineBuffer())
+
+    def lines():
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([_serialize(row[field]) for field in fields])
+    return _chunked(lines())
+
+
+def as_ndjson(rows):
+    return _chunked(
+        json.dumps({key: _serialize(value) for key, value in row.items()}, ensure_ascii=False) + '\n'
+        for row in rows
+    )
+
+
+def _anki_field(value):
+    return (value or '').replace('\t', ' ').replace('\r', ' ').replace('\n', '<br>')
+
+
+def anki_deck(user_id):
+    # Anki's text import format: the header lines configure the importer, and
+    # each note's Front/Back/Example fields are followed by its tags.
+    statement = select(
+        Vocabulary.spanish_word, Vocabulary.english_word, Vocabulary.pronunciation, Vocabulary.example_sentence,
+        LessonCategory.name, VocabularyReview.repetitions
+    ).join(Vocabulary, VocabularyReview.vocabulary_id == Vocabulary.id).join(
+        LessonCategory, Vocabulary.category_id == LessonCategory.id
+    ).where(VocabularyReview.user_id == user_id).order_by(LessonCategory.order, Vocabulary.id)
+
+    def lines():
+        yield '#separator:tab\n#html:true\n#notetype:Basic\n#deck:Lango Spanish\n#tags column:4\n'
+        for spanish, english, pronunciation, example, category, repetitions in _stream(statement):
+            back = _anki_field(english)
+            if pronunciation:
+                back += f"<br><i>{_anki_field(pronunciation)}</i>"
+            tags = ['lango', category.lower().replace(' ', '_')]
+            if repetitions >= 5:
+                tags.append('mastered')
+            yield f"{_anki_field(spanish)}\t{back}\t{_anki_field(example)}\t{' '.join(tags)}\n"
+    return _chunked(lines())
+
+
+def export(user_id, dataset, fmt):
+    rows = ROWS[dataset](user_id)
+    if fmt == 'csv':
+        return as_csv(DATASETS[dataset], rows)
+    return as_ndjson(rows)
@@ -0,0 +1,34 @@
+import logging
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', '/tmp/lango-jinja-cache')
+TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP', '1') == '1'
+
+# "1"/"0" force reloading on or off; unset follows the app's debug flag.
+TEMPLATES_AUTO_RELOAD = {'1': True, '0': False}.get(os.environ.get('TEMPLATES_AUTO_RELOAD'))
+
+
+def init_app(app):
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    # Must be set before the first render creates app.jinja_env.
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)}
+    app.config['TEMPLATES_AUTO_RELOAD'] = TEMPLATES_AUTO_RELOAD
+
+
+def warm_up(app):
+    started = time.perf_counter()
+    # The template folder is the project root, so only its own .html files
+    # are compiled instead of walking node_modules and the rest of the tree.
+    folder = os.path.join(app.root_path, app.template_folder)
+    names = sorted(name for name in os.listdir(folder) if name.endswith('.html'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    logging.info(f"Compiled {len(names)} templates in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    from app import app
+    warm_up(app)
@@ -0,0 +1,21 @@
+import logging
+import os
+
+from app import app, db
+import calendar_outbox
+import calendar_service
+import gemini_service
+import log_setup
+
+
+def init_worker():
+    log_setup.reset_after_fork()
+    # Connections, HTTP pools and API clients inherited from the preloading
+    # master share sockets with it, so each worker starts from fresh ones.
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    gemini_service.reset_client()
+    calendar_service.reset_connection()
+    calendar_outbox.start_dispatcher()
+    logging.info(f"Worker {os.getpid()} initialised")